@@ -1,8 +1,119 @@
+import time
 import chess
 from abc import ABC, abstractmethod
 
 
+class SearchStats:
+    """ What an agent did to find its last move. Agents fill in what applies to them, the
+    rest keeps the defaults
+    """
+
+    def __init__(self, agent=''):
+        self.agent = agent
+        self.move = None
+        self.nodes = 0
+        self.simulations = 0
+        self.depth = 0
+        self.time = 0.
+        self.cache_hit_rate = None
+        self.pv = []
+        self.score = None
+        # True when the move came from the opening book
+        self.book = False
+        # True when the move came from the endgame tablebase
+        self.tablebase = False
+        # One dict per worker process/thread, with the same kind of keys as to_dict
+        self.workers = []
+        # Seconds spent per phase, if profiling is enabled
+        self.phases = {}
+        # Size of the search trees kept in a NodeStore, see NodeStore.memory_usage
+        self.memory = None
+
+    def nps(self):
+        return self.nodes / self.time if self.time > 0 else 0.
+
+    def to_dict(self):
+        return {
+            'agent': self.agent,
+            'move': self.move.uci() if self.move else None,
+            'nodes': self.nodes,
+            'simulations': self.simulations,
+            'depth': self.depth,
+            'time': self.time,
+            'nps': self.nps(),
+            'cache_hit_rate': self.cache_hit_rate,
+            'pv': [move.uci() for move in self.pv],
+            'score': self.score,
+            'book': self.book,
+            'tablebase': self.tablebase,
+            'workers': self.workers,
+            'phases': self.phases,
+            'memory': self.memory}
+
+    def summary(self):
+        if self.book:
+            return '{} {}: from the opening book, {:.6f}s'.format(self.agent, self.move, self.time)
+        if self.tablebase:
+            return '{} {}: from the tablebase, {:.6f}s'.format(self.agent, self.move, self.time)
+        ret = '{} {}: {} nodes, depth {}, {:.2f}s, {:.0f} nodes/s'.format(
+            self.agent, self.move, self.nodes, self.depth, self.time, self.nps())
+        if self.simulations:
+            ret += ', {} simulations'.format(self.simulations)
+        if self.cache_hit_rate is not None:
+            ret += ', cache hit rate {:.1%}'.format(self.cache_hit_rate)
+        if self.pv:
+            ret += ', pv ' + ' '.join(move.uci() for move in self.pv)
+        if self.workers:
+            ret += ', {} workers'.format(len(self.workers))
+        if self.phases:
+            ret += ', phases ' + ' '.join('{} {:.3f}s'.format(k, v) for k, v in self.phases.items())
+        return ret
+
+
+class Profiler:
+    """ Sums up the time spent per phase. Only used when profiling is enabled, since reading
+    the clock in the hot loops costs a lot compared to the work being measured
+    """
+
+    def __init__(self):
+        self.phases = {}
+
+    def reset(self):
+        self.phases = {}
+
+    def add(self, phase, t_start):
+        self.phases[phase] = self.phases.get(phase, 0.) + time.perf_counter() - t_start
+
+    def wrap(self, phase, iterable):
+        # Count the time spent producing the items of a (lazy) iterable
+        iterator = iter(iterable)
+        while True:
+            t_start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(phase, t_start)
+                return
+            self.add(phase, t_start)
+            yield item
+
+
 class AgentBase(ABC):
+    # Statistics for the last move, set by make_move
+    stats = None
+    # Profiler when profiling is enabled
+    profiler = None
+    # The opponent's move that the last ponder expected, if any
+    ponder_move = None
+    # Statistics for the last ponder search, set by ponder
+    ponder_stats = None
+    # Opening book, see use_book
+    book = None
+    # Endgame tablebase, see use_tablebase
+    tablebase = None
+    # Game clock, see use_time_manager
+    time_manager = None
+
     def __init__(self):
         super(AgentBase, self).__init__()
 
@@ -10,6 +121,60 @@ class AgentBase(ABC):
     def make_move(self, board: chess.Board, is_white: bool):
         pass
 
+    def use_book(self, book):
+        # Play the moves of an openingbook.OpeningBook while the positions are in it
+        self.book = book
+
+    def use_tablebase(self, tablebase):
+        # Play the moves of a tablebase.Tablebase in the positions it has, and let the search
+        #   use its results
+        self.tablebase = tablebase
+
+    def use_time_manager(self, time_manager):
+        # Spend the time on a timemanager.TimeManager clock instead of a fixed time per move
+        self.time_manager = time_manager
+
+    def start_clock(self, board: chess.Board):
+        # Called first in make_move. Returns the soft and hard budget for the move in seconds,
+        #   or None without a time manager
+        if self.time_manager is None:
+            return None
+        return self.time_manager.start_move(board)
+
+    def stop_clock(self):
+        # Called last in make_move
+        if self.time_manager is not None:
+            self.time_manager.stop_move()
+
+    def known_move(self, board: chess.Board):
+        # Called in make_move before searching. Returns the move of the opening book or the
+        #   tablebase when they know the position, or None so the agent searches
+        if self.book is None and self.tablebase is None:
+            return None
+        t_start = time.time()
+        stats = SearchStats(type(self).__name__)
+        move = None
+        if self.book is not None:
+            move = self.book.get_move(board)
+            stats.book = move is not None
+        if move is None and self.tablebase is not None:
+            move = self.tablebase.best_move(board)
+            stats.tablebase = move is not None
+        if move is not None:
+            stats.move = move
+            stats.time = time.time() - t_start
+            self.stats = stats
+        return move
+
+    def ponder(self, board: chess.Board, is_white: bool, stop_event):
+        # Called in a separate thread while the opponent is to move in board. Searches until
+        #   stop_event is set, keeping whatever helps the next make_move. Does nothing by default
+        pass
+
+    def enable_profiling(self, enabled=True):
+        # Time the move generation, evaluation and selection phases of the search
+        self.profiler = Profiler() if enabled else None
+
 
 if __name__ == "__main__":
     print("Can't run this file directly")
@@ -1,164 +1,508 @@
 # This agent uses minimax with alpha-beta pruning
-from math import inf
+from math import inf, isinf
+import os
+import time
+import multiprocessing as mp
 import chess
-from agentbase import AgentBase
-
-# In the maps below, index 0 = A8 and index 63 = H1
-pawn_map_black = [
-    0, 0, 0, 0, 0, 0, 0, 0, 50, 50, 50, 50, 50, 50, 50, 50, 10, 10, 20, 30, 30, 20, 10, 10, 5, 5, 10, 25, 25, 10, 5, 5, 0, 0, 0, 20, 20, 0, 0, 0, 5, -5, -10, 0, 0, -10, -5, 5, 5, 10, 10, -20, -20, 10, 10, 5, 0, 0, 0, 0, 0, 0, 0, 0]
-knight_map_black = [
-    -50, -40, -30, -30, -30, -30, -40, -50,
-    -40, -20,  0,  0,  0,  0, -20, -40,
-    -30,  0, 10, 15, 15, 10,  0, -30,
-    -30,  5, 15, 20, 20, 15,  5, -30,
-    -30,  0, 15, 20, 20, 15,  0, -30,
-    -30,  5, 10, 15, 15, 10,  5, -30,
-    -40, -20,  0,  5,  5,  0, -20, -40,
-    -50, -40, -30, -30, -30, -30, -40, -50]
-bishop_map_black = [
-    -20, -10, -10, -10, -10, -10, -10, -20,
-    -10,  0,  0,  0,  0,  0,  0, -10,
-    -10,  0,  5, 10, 10,  5,  0, -10,
-    -10,  5,  5, 10, 10,  5,  5, -10,
-    -10,  0, 10, 10, 10, 10,  0, -10,
-    -10, 10, 10, 10, 10, 10, 10, -10,
-    -10,  5,  0,  0,  0,  0,  5, -10,
-    -20, -10, -10, -10, -10, -10, -10, -20]
-rook_map_black = [
-    0,  0,  0,  0,  0,  0,  0,  0,
-    5, 10, 10, 10, 10, 10, 10,  5,
-    -5,  0,  0,  0,  0,  0,  0, -5,
-    -5,  0,  0,  0,  0,  0,  0, -5,
-    -5,  0,  0,  0,  0,  0,  0, -5,
-    -5,  0,  0,  0,  0,  0,  0, -5,
-    -5,  0,  0,  0,  0,  0,  0, -5,
-    0,  0,  0,  5,  5,  0,  0,  0]
-queen_map_black = [
-    -20, -10, -10, -5, -5, -10, -10, -20,
-    -10,  0,  0,  0,  0,  0,  0, -10,
-    -10,  0,  5,  5,  5,  5,  0, -10,
-    -5,  0,  5,  5,  5,  5,  0, -5,
-    0,  0,  5,  5,  5,  5,  0, -5,
-    -10,  5,  5,  5,  5,  5,  0, -10,
-    -10,  0,  5,  0,  0,  0,  0, -10,
-    -20, -10, -10, -5, -5, -10, -10, -20]
-king_map_black = [
-    -30, -40, -40, -50, -50, -40, -40, -30,
-    -30, -40, -40, -50, -50, -40, -40, -30,
-    -30, -40, -40, -50, -50, -40, -40, -30,
-    -30, -40, -40, -50, -50, -40, -40, -30,
-    -20, -30, -30, -40, -40, -30, -30, -20,
-    -10, -20, -20, -20, -20, -20, -20, -10,
-    20, 20,  0,  0,  0,  0, 20, 20,
-    20, 30, 10,  0,  0, 10, 30, 20]
+from agentbase import AgentBase, SearchStats
+from evaluation import IncrementalEvaluator, evaluate
+from transpositiontable import TranspositionTable, EXACT, LOWER, UPPER
+from moveordering import MoveOrderer
+
+# Max depth for iterative deepening when no depth is given
+MAX_DEPTH = 64
+# Depth of the search when neither a depth nor a budget is given
+DEFAULT_DEPTH = 2
+
+
+class SearchAborted(Exception):
+    # Raised inside the search when the time or node budget is used up
+    pass
+
+
+def init_worker(tt_size_mb, bound, tablebase, batch_evaluator, profiling):
+    # Every process in the pool keeps its own agent, so its transposition table and move
+    #   ordering statistics are kept between the tasks. It searches like the agent that
+    #   started the pool, see pool_settings
+    global worker_agent, worker_bound
+    worker_agent = AgentMinimax(None, tt_size_mb, batch_evaluator=batch_evaluator)
+    worker_agent.use_tablebase(tablebase)
+    worker_agent.enable_profiling(profiling)
+    worker_bound = bound
+
+
+def search_root_move(task):
+    return worker_agent.__search_root_move__(worker_bound, *task)
 
 
 class AgentMinimax(AgentBase):
     """ Based on Minimax described here: http://mcts.ai/about/https://en.wikipedia.org/wiki/Minimax
+
+    Positions that have been searched are kept in a transposition table of tt_size_mb megabytes.
+    The table is kept between moves, so the work done for the previous move can be reused
+
+    When t_max (seconds) and/or max_nodes is given, iterative deepening is used: the search is
+    run for depth 1, 2, 3... (up to depth, if not None) until the budget is used up, and the best
+    move from the last completed iteration is played. An iteration that most likely won't
+    finish within t_max isn't started
+
+    With a time manager (see AgentBase.use_time_manager), iterative deepening is used with the
+    budgets of the clock: no iteration is started after the soft budget, and t_max is the hard one
+
+    With num_workers > 1 the root moves are split over a pool of processes. The first root
+    move is searched here to get a bound, and the rest are searched in parallel. The best
+    value found so far is shared between the processes and used as bound for the next move.
+    A value that doesn't beat the bound is only an upper limit, so when such a move ties with
+    or beats the best move found so far, it's searched again here with a full window. The
+    processes use the tablebase, batch evaluator and profiling of the agent
+
+    With a batchevaluation.BatchEvaluator as batch_evaluator, the positions of the last ply are
+    scored in one call per node instead of one push at a time, and the root moves are ordered
+    by the score of their positions
     """
-    def __init__(self, depth):
+    def __init__(self, depth, tt_size_mb=16, t_max=None, max_nodes=None, aspiration_window=50,
+                 num_workers=1, batch_evaluator=None):
         self.depth = depth
+        self.tt_size_mb = tt_size_mb
+        self.t_max = t_max
+        self.max_nodes = max_nodes
+        self.aspiration_window = aspiration_window
+        self.num_workers = num_workers
+        self.batch_evaluator = batch_evaluator
+        self.evaluator = IncrementalEvaluator()
+        self.tt = TranspositionTable(tt_size_mb)
+        self.orderer = MoveOrderer()
+        self.pool = None
+        self.bound = None
+        # What the pool processes were started with, see __start_pool__
+        self.pool_settings = None
+        self.search_id = 0
+        self.stop_event = None
+        # No new iteration is started after this many seconds, see __iterative_deepening__
+        self.soft_time = None
+        self.reset()
+
+    def __getstate__(self):
+        # The pool can't be sent to other processes
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['bound'] = None
+        state['stop_event'] = None
+        return state
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def reset(self):
+        self.no_nodes = 0
+        self.depth_reached = 0
+        self.score = None
+        self.t_start = time.time()
+        self.next_check = inf
+        self.worker_stats = {}
 
     def make_move(self, board, is_white):
-        _, moves = self.__choose__(board, is_white, self.depth)
+        budget = self.start_clock(board)
+        move = self.known_move(board)
+        if move is None and budget is None:
+            move = self.__search__(board, is_white)
+        elif move is None:
+            # Search by the clock: stop between iterations after the soft budget, and abort
+            #   an iteration at the hard budget
+            limits = (self.t_max, self.soft_time)
+            self.soft_time, self.t_max = budget
+            try:
+                move = self.__search__(board, is_white)
+            finally:
+                self.t_max, self.soft_time = limits
+        self.stop_clock()
+        return move
+
+    def __search__(self, board, is_white):
+        self.reset()
+        self.evaluator.reset(board)
+        self.tt.new_search()
+        self.orderer.new_search()
+        self.search_id += 1
+        if self.profiler is not None:
+            self.profiler.reset()
+        probes, hits = self.tt.probes, self.tt.hits
+        if self.t_max is None and self.max_nodes is None:
+            depth = self.depth or DEFAULT_DEPTH
+            if self.num_workers > 1:
+                self.score, moves = self.__choose_parallel__(
+                    board, is_white, depth, self.__root_moves__(board))
+            else:
+                self.score, moves = self.__choose__(board, is_white, depth)
+            self.depth_reached = depth
+        else:
+            moves = self.__iterative_deepening__(board, is_white)
+        self.__update_stats__(board, moves, self.tt.probes - probes, self.tt.hits - hits)
         if len(moves) == 0:
             return None
         else:
             return moves[0]
 
-    def __value_with_move__(self, board, move):
-        board.push(move)
-        val = self.__evaluate__(board)
-        board.pop()
-        return val
+    def ponder(self, board, is_white, stop_event):
+        # Search the position after the expected reply from the last search, or the position
+        #   the opponent is thinking about if there is none. The results stay in the
+        #   transposition table, so the search after the opponent's move goes quicker
+        board = board.copy()
+        pv = self.stats.pv if self.stats is not None else []
+        self.ponder_move = None
+        if len(pv) > 1 and board.move_stack and board.peek() == pv[0] and board.is_legal(pv[1]):
+            self.ponder_move = pv[1]
+            board.push(pv[1])
+        else:
+            is_white = not is_white
+        self.reset()
+        self.evaluator.reset(board)
+        self.tt.new_search()
+        self.search_id += 1
+        # Search locally and as deep as possible, until the opponent moves
+        limits = (self.t_max, self.max_nodes, self.num_workers)
+        self.t_max, self.max_nodes, self.num_workers = None, None, 1
+        self.stop_event = stop_event
+        probes, hits = self.tt.probes, self.tt.hits
+        try:
+            moves = self.__iterative_deepening__(board, is_white, MAX_DEPTH)
+        finally:
+            self.t_max, self.max_nodes, self.num_workers = limits
+            self.stop_event = None
+        # self.stats stays the one of the last move
+        stats = self.stats
+        self.__update_stats__(board, moves, self.tt.probes - probes, self.tt.hits - hits)
+        self.ponder_stats, self.stats = self.stats, stats
 
-    def __get_sorted_legal_moves__(self, board, is_white):
-        legal_moves = [(move, self.__value_with_move__(board, move))
-                       for idx, move in enumerate(board.legal_moves)]
-        legal_moves.sort(key=lambda x: x[1])
-        if is_white == True:
-            legal_moves.reverse()
-        sorted_legal_moves = [x[0] for x in legal_moves]
-        return sorted_legal_moves
+    def __update_stats__(self, board, moves, probes, hits):
+        stats = SearchStats('AgentMinimax')
+        stats.move = moves[0] if moves else None
+        stats.nodes = self.no_nodes
+        stats.depth = self.depth_reached
+        stats.time = time.time() - self.t_start
+        stats.cache_hit_rate = hits / probes if probes > 0 else 0.
+        stats.score = self.score
+        stats.pv = self.get_pv(board)
+        stats.workers = list(self.worker_stats.values())
+        if self.profiler is not None:
+            stats.phases = dict(self.profiler.phases)
+        self.stats = stats
 
-    def __choose__(self, board, is_white, depth, alpha=-inf, beta=inf):
+    def __push__(self, board, move):
+        if self.profiler is None:
+            self.evaluator.push(board, move)
+        else:
+            # Making the move includes the incremental evaluation
+            t_start = time.perf_counter()
+            self.evaluator.push(board, move)
+            self.profiler.add('evaluate', t_start)
+
+    def __iterative_deepening__(self, board, is_white, max_depth=None):
+        max_depth = max_depth or self.depth or MAX_DEPTH
+        root_moves = self.__root_moves__(board)
+        if len(root_moves) == 0:
+            return []
+        moves = root_moves[:1]
+        value = None
+        self.__schedule_check__()
+        num_pushed = len(board.move_stack)
+        iteration_times = [0.]
+        for depth in range(1, max_depth+1):
+            t_iteration = time.time()
+            try:
+                value, iteration_moves = self.__search_iteration__(
+                    board, is_white, depth, value, root_moves)
+            except SearchAborted:
+                # Undo the moves of the interrupted iteration
+                while len(board.move_stack) > num_pushed:
+                    self.evaluator.pop(board)
+                break
+            if len(iteration_moves) > 0:
+                moves = iteration_moves
+                # Search the principal variation first in the next iteration
+                root_moves.remove(moves[0])
+                root_moves.insert(0, moves[0])
+            self.depth_reached = depth
+            self.score = value
+            # No reason to search deeper when a mate is found
+            if isinf(value):
+                break
+            iteration_times.append(time.time() - t_iteration)
+            if self.t_max is not None and not self.__next_iteration_fits__(iteration_times, len(root_moves)):
+                break
+        return moves
+
+    def __next_iteration_fits__(self, iteration_times, num_root_moves):
+        # False when the next iteration isn't worth starting: past the soft budget, or when it
+        #   would most likely be aborted at t_max. Every iteration takes about as many times
+        #   longer than the one before as the last one did, at least twice as long
+        elapsed = time.time() - self.t_start
+        soft_time = self.t_max if self.soft_time is None else self.soft_time
+        if num_root_moves == 1 or elapsed >= soft_time:
+            return False
+        last, previous = iteration_times[-1], iteration_times[-2]
+        growth = min(max(last / previous, 2.), 10.) if previous > 0.001 else 2.
+        return elapsed + last * growth < self.t_max
+
+    def __root_moves__(self, board):
+        hash_entry = self.tt.probe(self.evaluator.key)
+        hash_move = hash_entry.move if hash_entry else None
+        root_moves = list(self.orderer.ordered_moves(board, 0, hash_move))
+        if self.batch_evaluator is not None and len(root_moves) > 1:
+            # Order by the static score of the child positions, best first, after the hash move
+            moves, scores = self.batch_evaluator.evaluate_children(board, root_moves)
+            sign = 1 if board.turn == chess.WHITE else -1
+            order = sorted(range(len(moves)), key=lambda idx: (moves[idx] != hash_move, -sign * scores[idx]))
+            root_moves = [moves[idx] for idx in order]
+        return root_moves
+
+    def __search_iteration__(self, board, is_white, depth, prev_value, root_moves):
+        if self.num_workers > 1:
+            return self.__choose_parallel__(board, is_white, depth, root_moves)
+        if prev_value is not None and not isinf(prev_value) and self.aspiration_window:
+            # Aspiration window around the value of the previous iteration
+            alpha = prev_value - self.aspiration_window
+            beta = prev_value + self.aspiration_window
+            value, moves = self.__choose__(
+                board, is_white, depth, alpha, beta, 0, root_moves)
+            if alpha < value < beta:
+                return value, moves
+        # The value fell outside the window, so search again with a full window
+        return self.__choose__(board, is_white, depth, -inf, inf, 0, root_moves)
+
+    def __choose_parallel__(self, board, is_white, depth, root_moves):
+        # Root splitting: search the first move here to get a bound, then the rest in the pool
+        if len(root_moves) == 0:
+            return (-inf if is_white else inf), []
+        self.__start_pool__()
+        # All values below are from white's point of view, while the shared bound is the best
+        #   value for the side to move
+        sign = 1 if is_white else -1
+        best_move = root_moves[0]
+        self.evaluator.push(board, best_move)
+        value, _ = self.__choose__(board, not is_white, depth-1, -inf, inf, 1)
+        self.evaluator.pop(board)
+        self.bound.value = sign * value
+        max_nodes = None if self.max_nodes is None else self.max_nodes - self.no_nodes
+        tasks = [(board, move, depth, self.search_id, self.t_start, self.t_max, max_nodes)
+                 for move in root_moves[1:]]
+        aborted = False
+        for move, cvalue, exact, no_nodes, pid, phases in self.pool.imap_unordered(search_root_move, tasks):
+            self.no_nodes += no_nodes
+            worker = self.worker_stats.setdefault(pid, {'pid': pid, 'nodes': 0, 'tasks': 0})
+            worker['nodes'] += no_nodes
+            worker['tasks'] += 1
+            if self.profiler is not None:
+                for phase, seconds in phases.items():
+                    self.profiler.phases[phase] = self.profiler.phases.get(phase, 0.) + seconds
+            if cvalue is None:
+                aborted = True
+                continue
+            if not exact and not aborted and sign * cvalue >= sign * value:
+                # Only an upper limit, which may be the bound raised by a result that isn't
+                #   in yet. The real value decides
+                self.evaluator.push(board, move)
+                try:
+                    cvalue, _ = self.__choose__(board, not is_white, depth-1, -inf, inf, 1)
+                finally:
+                    self.evaluator.pop(board)
+            if sign * cvalue > sign * value:
+                value, best_move = cvalue, move
+        if aborted or (self.max_nodes is not None and self.no_nodes >= self.max_nodes):
+            raise SearchAborted()
+        self.tt.store(self.evaluator.key, depth, value, EXACT, best_move)
+        return value, [best_move]
+
+    def __start_pool__(self):
+        # The processes are started again when the tablebase, batch evaluator or profiling
+        #   changed since they were started
+        settings = (self.tablebase, self.batch_evaluator, self.profiler is not None)
+        if self.pool is not None and any(new is not old for new, old in zip(settings, self.pool_settings)):
+            self.close()
+        if self.pool is None:
+            self.bound = mp.Value('d', -inf)
+            self.pool = mp.Pool(self.num_workers, init_worker, (self.tt_size_mb, self.bound) + settings)
+            self.pool_settings = settings
+
+    def __search_root_move__(self, bound, board, move, depth, search_id, t_start, t_max, max_nodes):
+        # Runs in a pool process. Returns None as value if the budget ran out. exact is False
+        #   when the value doesn't beat the bound, so it's only an upper limit
+        if search_id != self.search_id:
+            self.search_id = search_id
+            self.tt.new_search()
+            self.orderer.new_search()
+        self.no_nodes = 0
+        self.t_start = t_start
+        self.t_max = t_max
+        self.max_nodes = max_nodes
+        self.__schedule_check__()
+        is_white = board.turn
+        if self.profiler is not None:
+            self.profiler.reset()
+        self.evaluator.reset(board)
+        self.evaluator.push(board, move)
+        best = bound.value
+        if is_white:
+            alpha, beta = best, inf
+        else:
+            alpha, beta = -inf, -best
+        try:
+            value, _ = self.__choose__(board, not is_white, depth-1, alpha, beta, 1)
+        except SearchAborted:
+            return move, None, False, self.no_nodes, os.getpid(), self.__phases__()
+        score = value if is_white else -value
+        with bound.get_lock():
+            if score > bound.value:
+                bound.value = score
+        return move, value, score > best, self.no_nodes, os.getpid(), self.__phases__()
+
+    def __phases__(self):
+        return dict(self.profiler.phases) if self.profiler is not None else {}
+
+    def __schedule_check__(self):
+        # Looking at the clock is expensive compared to visiting a node, so only check it
+        #   every 1024 nodes
+        self.next_check = self.no_nodes + 1024
+        if self.max_nodes is not None:
+            self.next_check = min(self.next_check, self.max_nodes)
+
+    def __check_budget__(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchAborted()
+        if self.max_nodes is not None and self.no_nodes >= self.max_nodes:
+            raise SearchAborted()
+        if self.t_max is not None and time.time()-self.t_start >= self.t_max:
+            raise SearchAborted()
+        self.__schedule_check__()
+
+    def get_pv(self, board, max_length=None):
+        # Principal variation from the transposition table
+        max_length = max_length or self.depth_reached
+        pv = []
+        num_pushed = len(board.move_stack)
+        entry = self.tt.probe(self.evaluator.key)
+        while entry is not None and entry.move and len(pv) < max_length and board.is_legal(entry.move):
+            pv.append(entry.move)
+            self.evaluator.push(board, entry.move)
+            entry = self.tt.probe(self.evaluator.key)
+        while len(board.move_stack) > num_pushed:
+            self.evaluator.pop(board)
+        return pv
+
+    def __choose__(self, board, is_white, depth, alpha=-inf, beta=inf, ply=0, root_moves=None):
+        self.no_nodes += 1
+        if self.no_nodes >= self.next_check:
+            self.__check_budget__()
+        if self.tablebase is not None and ply > 0:
+            # The tablebase knows the value of the position, so no need to search
+            score = self.tablebase.score(board, ply, self.evaluator.key)
+            if score is not None:
+                return score, []
         if depth == 0:
-            return self.__evaluate__(board), []
+            return self.evaluator.score, []
+        key = self.evaluator.key
+        hash_move = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            hash_move = entry.move
+            # Don't cut at the root since we must return a move that's legal for sure
+            if entry.depth >= depth and ply > 0:
+                if entry.bound == EXACT:
+                    return entry.score, [entry.move] if entry.move else []
+                elif entry.bound == LOWER:
+                    alpha = max(alpha, entry.score)
+                else:
+                    beta = min(beta, entry.score)
+                if alpha >= beta:
+                    return entry.score, [entry.move] if entry.move else []
+        if depth == 1 and self.batch_evaluator is not None and root_moves is None and self.tablebase is None:
+            value, moves = self.__choose_leaves__(board, is_white)
+            if moves:
+                self.tt.store(key, depth, value, EXACT, moves[0])
+                return value, moves
+        alpha_start, beta_start = alpha, beta
         if is_white == True:
             value = -inf
             moves = []
-            sorted_legal_moves = self.__get_sorted_legal_moves__(
-                board, is_white)
-            for cur_move in sorted_legal_moves:
-                board.push(cur_move)
-                cvalue, _ = self.__choose__(board, False, depth-1, alpha, beta)
-                board.pop()
+            sorted_legal_moves = root_moves or self.orderer.ordered_moves(
+                board, ply, hash_move)
+            if self.profiler is not None:
+                sorted_legal_moves = self.profiler.wrap('movegen', sorted_legal_moves)
+            for move_number, cur_move in enumerate(sorted_legal_moves):
+                self.__push__(board, cur_move)
+                cvalue, _ = self.__choose__(board, False, depth-1, alpha, beta, ply+1)
+                self.evaluator.pop(board)
                 if cvalue > value:
                     value = cvalue
                     moves.clear()
                     moves.append(cur_move)
                 alpha = max(alpha, value)
                 if alpha >= beta:
+                    self.orderer.record_cutoff(board, cur_move, ply, depth, move_number)
                     break
-            return value, moves
         else:
             value = inf
             moves = []
-            sorted_legal_moves = sorted_legal_moves = self.__get_sorted_legal_moves__(
-                board, is_white)
-            for cur_move in sorted_legal_moves:
-                board.push(cur_move)
-                cvalue, _ = self.__choose__(board, True, depth-1, alpha, beta)
-                board.pop()
+            sorted_legal_moves = root_moves or self.orderer.ordered_moves(
+                board, ply, hash_move)
+            if self.profiler is not None:
+                sorted_legal_moves = self.profiler.wrap('movegen', sorted_legal_moves)
+            for move_number, cur_move in enumerate(sorted_legal_moves):
+                self.__push__(board, cur_move)
+                cvalue, _ = self.__choose__(board, True, depth-1, alpha, beta, ply+1)
+                self.evaluator.pop(board)
                 if cvalue < value:
                     value = cvalue
                     moves.clear()
                     moves.append(cur_move)
                 beta = min(beta, value)
                 if alpha >= beta:
+                    self.orderer.record_cutoff(board, cur_move, ply, depth, move_number)
                     break
-            return value, moves
-
-    def __value_of_pieces__(self, board, is_white):
-        # Count the number of pieces left and give them a value
-        # https://www.chessprogramming.org/Simplified_Evaluation_Function
-        ret = len(board.pieces(chess.PAWN, is_white)) * 100
-        ret += len(board.pieces(chess.KNIGHT, is_white)) * 320
-        ret += len(board.pieces(chess.BISHOP, is_white)) * 330
-        ret += len(board.pieces(chess.ROOK, is_white)) * 500
-        ret += len(board.pieces(chess.QUEEN, is_white)) * 900
-        ret += len(board.pieces(chess.KING, is_white)) * 20000
-        return ret
-
-    def __value_of_position__(self, board, is_white):
-        # Index 0 = A1, index 63 = H8 in the python-chess lib. So, invert for white pieces
-        switcher = {
-            'p': pawn_map_black,
-            'P': pawn_map_black[::-1],
-            'n': knight_map_black,
-            'N': knight_map_black[::-1],
-            'b': bishop_map_black,
-            'B': bishop_map_black[::-1],
-            'r': rook_map_black,
-            'R': rook_map_black[::-1],
-            'q': queen_map_black,
-            'Q': queen_map_black[::-1],
-            'k': king_map_black,
-            'K': king_map_black[::-1]}
-        pieces = board.piece_map()
-        ret = 0
-        for pos, piece in pieces.items():
-            if piece.color == is_white:
-                ret += switcher[piece.symbol()][pos]
-        return ret
+        if value <= alpha_start:
+            bound = UPPER
+        elif value >= beta_start:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, value, bound, moves[0] if moves else None)
+        return value, moves
+
+    def __choose_leaves__(self, board, is_white):
+        # The last ply, with all the child positions scored in one call of the batch evaluator
+        if self.profiler is not None:
+            t_start = time.perf_counter()
+        moves, scores = self.batch_evaluator.evaluate_children(board)
+        if self.profiler is not None:
+            self.profiler.add('evaluate', t_start)
+        if len(moves) == 0:
+            return None, []
+        self.no_nodes += len(moves)
+        idx = int(scores.argmax() if is_white else scores.argmin())
+        return int(scores[idx]), [moves[idx]]
 
     def __evaluate__(self, board):
-        value_white = self.__value_of_pieces__(
-            board, True)+self.__value_of_position__(board, True)
-        value_black = self.__value_of_pieces__(
-            board, False)+self.__value_of_position__(board, False)
-        value_total = value_white-value_black
-        return value_total
+        # Full evaluation. The search itself uses the incrementally updated self.evaluator.score
+        return evaluate(board)
+
+
+def compare_parallel(board, depth, num_workers=None, tt_size_mb=16):
+    # Speedup of the parallel search compared to a single process at the same depth
+    num_workers = num_workers or mp.cpu_count()
+    ret = {'depth': depth, 'num_workers': num_workers}
+    for name, workers in (('single', 1), ('parallel', num_workers)):
+        agent = AgentMinimax(depth, tt_size_mb, num_workers=workers)
+        if workers > 1:
+            # Start the pool outside of the timing
+            agent.__start_pool__()
+        t_start = time.time()
+        move = agent.make_move(board.copy(), board.turn)
+        ret[name] = {'time': time.time()-t_start, 'nodes': agent.no_nodes, 'move': move.uci() if move else None}
+        agent.close()
+    ret['speedup'] = ret['single']['time'] / max(ret['parallel']['time'], 1e-9)
+    return ret
 
 
 if __name__ == "__main__":
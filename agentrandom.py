@@ -1,11 +1,23 @@
-from agentbase import AgentBase
+from agentbase import AgentBase, SearchStats
 import random
+import time
 
 
 class AgentRandom(AgentBase):
     def make_move(self, board, is_white):
+        self.start_clock(board)
+        move = self.known_move(board)
+        if move is not None:
+            self.stop_clock()
+            return move
+        t_start = time.time()
         legal_moves = [move for _, move in enumerate(board.legal_moves)]
         move = random.choice(legal_moves)
+        self.stats = SearchStats('AgentRandom')
+        self.stats.move = move
+        self.stats.nodes = len(legal_moves)
+        self.stats.time = time.time() - t_start
+        self.stop_clock()
         return move
 
 
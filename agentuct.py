@@ -1,60 +1,136 @@
 from cmath import e
 from xmlrpc.client import Boolean
-from agentbase import AgentBase
+from agentbase import AgentBase, SearchStats
 import time
 import random
 import math
-import operator
 import multiprocessing as mp
+import copy
+import os
+import queue
+import threading
 import chess
-from typing import List
+from mctstree import NodeStore, NO_NODE
+from evaluation import evaluate
+from movegen import FastBoard
+
+results = {'1-0': 1, '1/2-1/2': 0.5, '0-1': 0}
+
+
+def random_legal_move(board: chess.Board):
+    # Pick pseudo-legal moves at random until one doesn't leave the king in check. Cheaper
+    #   than generating all legal moves, since only the tried moves are checked
+    moves = list(board.generate_pseudo_legal_moves())
+    while moves:
+        idx = random.randrange(len(moves))
+        move = moves[idx]
+        if not board.is_into_check(move):
+            return move
+        moves[idx] = moves[-1]
+        moves.pop()
+    return None
+
+
+def win_probability(score):
+    # Map an evaluation in centipawns (white's point of view) to an expected result for white
+    return 1 / (1 + 10 ** (-score / 400))
 
 
 class MCTSNode:
+    # TODO: C should be determined empirically. Found that sqrt(2) should be good somewhere
+    c = math.sqrt(2)
+
     # level 0 = root
     def __init__(self, number_of_children, level):
         self.children = [None for x in range(0, number_of_children)]
         self.visits = 0  # Number of times this node is visited
-        self.value = 0.  # Add 1 for white win, 0 for draw, -1 for black win
+        self.value = 0.  # 1 per win, 0.5 per draw for the player that made the move to this node
         self.level = level
+        # Children that aren't created yet, in no particular order
+        self.unexpanded = list(range(0, number_of_children))
+        # Children grouped by number of visits, created on first use. See child_visited
+        self.buckets = None
+
+    def reset_tracking(self):
+        # Used when the children list is replaced
+        self.unexpanded = [idx for idx, child in enumerate(self.children) if child is None]
+        self.buckets = None
+
+    def set_child(self, idx, node):
+        self.children[idx] = node
+        pos = self.unexpanded.index(idx)
+        self.unexpanded[pos] = self.unexpanded[-1]
+        self.unexpanded.pop()
+
+    def build_buckets(self):
+        self.buckets = {}
+        self.bucket_pos = [0] * len(self.children)
+        for idx, child in enumerate(self.children):
+            bucket = self.buckets.setdefault(child.visits if child else 0, [])
+            self.bucket_pos[idx] = len(bucket)
+            bucket.append(idx)
+        self.min_visits = min(self.buckets) if self.buckets else 0
+
+    def child_visited(self, idx):
+        # Must be called every time the visits of a child are increased by one, to move it to
+        #   the next bucket. Since visits only grow by one, the minimum is the next bucket when
+        #   the lowest one gets empty
+        if self.buckets is None:
+            return
+        visits = self.children[idx].visits
+        bucket = self.buckets[visits-1]
+        last = bucket.pop()
+        if last != idx:
+            pos = self.bucket_pos[idx]
+            bucket[pos] = last
+            self.bucket_pos[last] = pos
+        if len(bucket) == 0:
+            del self.buckets[visits-1]
+            if self.min_visits == visits-1:
+                self.min_visits = visits
+        bucket = self.buckets.setdefault(visits, [])
+        self.bucket_pos[idx] = len(bucket)
+        bucket.append(idx)
 
     def get_node_to_explore(self):
-        if None in self.children:
-            idxs = [i for i, e in enumerate(self.children) if e == None]
-            idx = random.choice(idxs)
+        if len(self.unexpanded) > 0:
+            idx = random.choice(self.unexpanded)
             return idx, None
         else:
-            visit_count = list(map(lambda x: x.visits, self.children))
-            min_val = min(visit_count)
-            idxs = [i for i, e in enumerate(
-                self.children) if e.visits == min_val]
-            idx = random.choice(idxs)
+            if self.buckets is None:
+                self.build_buckets()
+            idx = random.choice(self.buckets[self.min_visits])
             return idx, self.children[idx]
 
     def get_promising_children(self):
-        nodes_with_values = [(idx, child.ucb_value(self.visits))
-                             for idx, child in enumerate(self.children)]
-        nodes_with_values.sort(key=lambda x: x[1], reverse=True)
-        node_idx = nodes_with_values[0][0]
-        return node_idx, self.children[node_idx]
+        # One pass over the children with the parent's part of the UCB formula precomputed
+        c_log_parent = self.c * math.sqrt(math.log(self.visits)) if self.visits > 0 else 0.
+        children = self.children
+        best_idx, best_value = 0, -math.inf
+        for idx in range(0, len(children)):
+            child = children[idx]
+            visits = child.visits
+            value = child.value/visits + c_log_parent/math.sqrt(visits) if visits > 0 else 0
+            if value > best_value:
+                best_idx, best_value = idx, value
+        return best_idx, children[best_idx]
 
     def must_explore(self, min_tries_per_node) -> Boolean:
-        if None in self.children:
+        if len(self.unexpanded) > 0:
             return True
         elif len(self.children) == 0:
             return False
         else:
-            visits_per_child = list(map(lambda x: x.visits, self.children))
-            return min(visits_per_child) < min_tries_per_node
+            if self.buckets is None:
+                self.build_buckets()
+            return self.min_visits < min_tries_per_node
 
     def ucb_value(self, number_of_visits_parent):
         if self.visits == 0:
             return 0
-        # TODO: C should be determined empirically. Found that sqrt(2) should be good somewhere
-        c = math.sqrt(2)
         number_of_visits = self.visits
         vi = self.value/number_of_visits
-        value = vi + c * \
+        value = vi + self.c * \
             math.sqrt(math.log(number_of_visits_parent)/number_of_visits)
         return value
 
@@ -64,8 +140,6 @@ class ChessNode(MCTSNode):
         self.legal_moves = [move for _, move in enumerate(board.legal_moves)]
         if start_legal_move != None:
             self.legal_moves = self.legal_moves[start_legal_move:start_legal_move+max_legal_moves]
-            print(self.legal_moves)
-            print('Count: {}'.format(len(self.legal_moves)))
         super().__init__(len(self.legal_moves), level)
 
     def get_child(self, board: chess.Board, min_tries_per_node):
@@ -77,12 +151,40 @@ class ChessNode(MCTSNode):
                 board.push(cur_move)
                 child_node = ChessNode(board, self.level+1)
                 board.pop()
-                self.children[idx] = child_node
+                self.set_child(idx, child_node)
                 new_node_created = True
         else:
             idx, child_node, cur_move = self.get_promising_children()
         return idx, child_node, cur_move, new_node_created
 
+    def principal_variation(self, max_length=20):
+        # Follow the most visited child
+        ret = []
+        node = self
+        while len(ret) < max_length:
+            visited = [(child.visits, move, child) for move, child in zip(
+                node.legal_moves, node.children) if child is not None and child.visits > 0]
+            if len(visited) == 0:
+                break
+            _, move, node = max(visited, key=lambda x: x[0])
+            ret.append(move)
+        return ret
+
+    def find_child(self, move: chess.Move):
+        # The subtree for the given move, or None if it hasn't been created
+        if move in self.legal_moves:
+            return self.children[self.legal_moves.index(move)]
+        return None
+
+    def sliced(self, start_legal_move, max_legal_moves):
+        # Copy of this node that only has a part of the moves, keeping the subtrees that are
+        #   searched already
+        node = copy.copy(self)
+        node.legal_moves = self.legal_moves[start_legal_move:start_legal_move+max_legal_moves]
+        node.children = self.children[start_legal_move:start_legal_move+max_legal_moves]
+        node.reset_tracking()
+        return node
+
     def get_move_to_explore(self):
         idx, node = self.get_node_to_explore()
         return idx, node, self.legal_moves[idx]
@@ -92,104 +194,765 @@ class ChessNode(MCTSNode):
         return idx, node, self.legal_moves[idx]
 
 
+def uct_worker(agent, pid, task_queue, out_queue, shared_tree=None):
+    # Long-lived worker process. Keeps its search tree between the moves and reuses the
+    #   subtree of the new position when it's found in the tree
+    tree = None
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        tree = run_task(agent, tree, task, pid, out_queue, shared_tree)
+
+
+def run_task(agent, tree, task, pid, out_queue, shared_tree=None):
+    # Search one position and put the result on out_queue. Returns the tree to keep for the
+    #   next task
+    board, is_white, t_start, budget, start_legal_move, max_legal_moves = task
+    if budget is not None:
+        agent.budget = budget
+    agent.reused_visits = 0
+    if shared_tree is not None:
+        # Tree parallel: all workers search the same tree in shared memory
+        store, lock = shared_tree
+        agent.run_it_shared(board, is_white, store, lock, t_start, pid, out_queue)
+        return tree
+    if agent.max_nodes:
+        root_part = agent.find_store_subtree(tree, board, start_legal_move)
+        if root_part is None:
+            root_part = agent.new_store(board, start_legal_move, max_legal_moves)
+        else:
+            agent.reused_visits = int(root_part.visits[0])
+    else:
+        root_part = agent.find_subtree(tree, board, start_legal_move, max_legal_moves)
+        if root_part is None:
+            root_part = ChessNode(board, 0, start_legal_move, max_legal_moves)
+        else:
+            agent.reused_visits = root_part.visits
+    tree = (board.move_stack.copy(), start_legal_move, max_legal_moves, root_part)
+    if agent.max_nodes:
+        agent.run_it_store(board, is_white, root_part, t_start, pid, out_queue)
+    else:
+        agent.run_it(board, is_white, root_part, t_start, pid, out_queue)
+    return tree
+
+
 class AgentUCT(AgentBase):
     """ Based on UCT ( = MCTS + UCB) described here:
     https://www.chessprogramming.org/Monte-Carlo_Tree_Search
     
     https://en.wikipedia.org/wiki/Monte_Carlo_tree_search
+
+    The worker processes are started on the first move and kept until close() is called. Each
+    worker keeps its tree, so the statistics for the position after our move and the
+    opponent's reply keep counting
+
+    By default every worker searches all the root moves (root parallel) and the visits and
+    values per move are merged before the most visited move is chosen. num_processes
+    defaults to the number of usable CPUs. With split_root_moves, each worker instead
+    searches its own part of the root moves
+
+    With max_nodes set, the tree is kept in a NodeStore with room for that many nodes
+    instead of as ChessNode objects. When the store is full, simulations continue from the
+    last node with random moves that aren't stored
+
+    Each simulation adds one node to the tree and plays the rest of the game out with random
+    moves, for at most rollout_depth plies. If the game isn't over by then, the static
+    evaluation decides the result. With rollout_depth=None, the tree is instead expanded all
+    the way to the end of the game (or 150 plies), as originally done
+
+    With tree_parallel set to 'threads' or 'processes', all workers search one shared
+    NodeStore instead of their own trees. A worker adds a virtual loss to every node on its
+    way down, so the other workers are steered to other branches, and collects batch_size
+    leaves before playing them out and updating the tree. Threads only run in parallel on a
+    Python build without the GIL. Processes share the tree through shared memory
+
+    max_simulations caps the number of simulations per worker, which makes runs comparable
+    regardless of the speed of the machine
+
+    Every move gets a soft and a hard budget: both t_max, or those of the time manager (see
+    AgentBase.use_time_manager). A worker stops before the soft budget when the most visited
+    root move is further ahead than the simulations left until then, so nothing could overtake
+    it. After the soft budget it goes on until the hard one only while the most visited move
+    isn't also the one with the best average value. With only one legal move, it's played
+    right away. The clock is read about every check_period seconds, counted in simulations
+
+    With a batchevaluation.BatchEvaluator as batch_evaluator, the leaves of every tree parallel
+    batch are scored together by it instead of being played out
+
+    With fast_movegen, the random playouts run on a movegen.FastBoard instead of a chess.Board,
+    which plays them several times faster. Repetitions aren't detected in the playouts then, and
+    the playouts go back to the chess.Board when a tablebase is used
+
+    With in_process, the search runs in the calling process, with the tree kept in the agent,
+    instead of in worker processes. Used when the caller already runs one search per CPU,
+    see enginepool
+
+    ponder lets the workers search the opponent's position, all replies included, while the
+    opponent thinks. The workers then reuse the subtree of the reply that was played. With
+    in_process, the search runs in the tree kept in the agent instead. Not available with
+    tree_parallel, since the shared tree is rebuilt for every move
     """
 
-    def __init__(self, t_max, min_tries_per_node):
+    # Max number of plies between the old and the new root for the tree to be reused
+    max_reuse_distance = 4
+    # Seconds between looking at the clock, see keep_searching
+    check_period = 0.01
+
+    def __init__(self, t_max, min_tries_per_node, num_processes=None, split_root_moves=False,
+                 max_nodes=None, rollout_depth=40, tree_parallel=None, batch_size=8,
+                 virtual_loss=1, max_simulations=None, in_process=False, batch_evaluator=None,
+                 fast_movegen=False):
         self.t_max = t_max
         self.min_tries_per_node = min_tries_per_node
+        self.num_processes = num_processes
+        self.split_root_moves = split_root_moves
+        self.max_nodes = max_nodes
+        self.rollout_depth = rollout_depth
+        self.tree_parallel = tree_parallel
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        self.max_simulations = max_simulations
+        self.in_process = in_process
+        self.batch_evaluator = batch_evaluator
+        # Board for the playouts, see fast_rollout
+        self.fast_board = FastBoard() if fast_movegen else None
+        # The tree of the last in-process search, see run_task
+        self.local_tree = None
+        self.shared_tree = None
         self.max_level = 0
         self.no_nodes = 0
+        self.no_simulations = 0
+        self.root_level = 0
+        # Visits of the subtree from the last search that the current one started from
+        self.reused_visits = 0
+        self.workers = []
+        # Set to stop the workers, see ponder
+        self.stop_event = None
+        # Soft and hard time budget of the current move, in seconds
+        self.budget = (t_max, t_max)
+        self.next_check = 0
+
+    def __getstate__(self):
+        # The processes and queues can't be sent to other processes
+        state = self.__dict__.copy()
+        state['workers'] = []
+        state['shared_tree'] = None
+        return state
 
     def reset(self):
         self.max_level = 0
         self.no_nodes = 0
+        self.no_simulations = 0
+        self.next_check = 0
+        if self.profiler is not None:
+            self.profiler.reset()
 
-    def uct(self, board: chess.Board, is_white, node):
+    def timed(self, phase, func, *args):
+        # Call func, adding the time it takes to the phase when profiling
+        if self.profiler is None:
+            return func(*args)
+        t_start = time.perf_counter()
+        ret = func(*args)
+        self.profiler.add(phase, t_start)
+        return ret
+
+    def worker_report(self, pid, pv, memory=None):
+        # Statistics of one worker, sent to the main process with the move statistics
+        return {
+            'pid': pid,
+            'nodes': self.no_nodes,
+            'simulations': self.no_simulations,
+            'max_level': self.max_level,
+            'reused_visits': self.reused_visits,
+            'memory': memory,
+            'pv': [move.uci() for move in pv],
+            'phases': dict(self.profiler.phases) if self.profiler is not None else {}}
+
+    def keep_searching(self, t_start, root_stats=None):
+        # root_stats returns (visits, value) for the root moves, when they can be compared to
+        #   stop early. The clock and the stop event are only looked at every check_period
+        #   seconds, judging by the number of simulations per second so far
+        if self.max_simulations is not None and self.no_simulations >= self.max_simulations:
+            return False
+        if self.no_simulations < self.next_check:
+            return True
+        if self.stop_event is not None and self.stop_event.is_set():
+            return False
+        if t_start is None:
+            # Without a start time, only the stop event ends the search
+            self.next_check = self.no_simulations + 1
+            return True
+        elapsed = time.time() - t_start
+        rate = self.no_simulations / elapsed if elapsed > 0 else 0.
+        self.next_check = self.no_simulations + max(1, int(rate * self.check_period))
+        soft, hard = self.budget
+        if elapsed >= hard:
+            return False
+        if root_stats is None:
+            return elapsed < soft
+        return not self.decided(root_stats(), elapsed, rate)
+
+    def decided(self, root_stats, elapsed, rate):
+        # True when more simulations wouldn't change the move. See the class description
+        if self.no_simulations == 0:
+            # No idea yet how many simulations there is time for
+            return False
+        root_stats = sorted(root_stats, reverse=True)
+        (visits, value), (second_visits, _) = root_stats[0], root_stats[1]
+        soft, _ = self.budget
+        if elapsed < soft:
+            return visits - second_visits > rate * (soft - elapsed)
+        return visits > 0 and all(value / visits >= other_value / other_visits
+                                  for other_visits, other_value in root_stats[1:] if other_visits > 0)
+
+    def start_workers(self, num_processes):
+        if len(self.workers) == 0:
+            self.out_queue = mp.Queue()
+            self.stop_event = mp.Event()
+        for pid in range(len(self.workers), num_processes):
+            task_queue = mp.Queue()
+            process = mp.Process(target=uct_worker, args=(
+                self, pid+1, task_queue, self.out_queue, self.shared_tree), daemon=True)
+            process.start()
+            self.workers.append((process, task_queue))
+
+    def close(self):
+        for _, task_queue in self.workers:
+            task_queue.put(None)
+        for process, _ in self.workers:
+            process.join()
+        self.workers = []
+        self.stop_event = None
+
+    def find_subtree(self, tree, board: chess.Board, start_legal_move, max_legal_moves):
+        # Walk from the previous root to the current position, if it's reachable
+        if tree is None:
+            return None
+        move_stack, old_start, old_max, node = tree
+        new_moves = board.move_stack[len(move_stack):]
+        if board.move_stack[:len(move_stack)] != move_stack or len(new_moves) > self.max_reuse_distance:
+            return None
+        if len(new_moves) == 0:
+            # The old root only has a part of the moves, so it's only usable for the same part
+            return node if (old_start, old_max) == (start_legal_move, max_legal_moves) else None
+        for move in new_moves:
+            node = node.find_child(move)
+            if node is None:
+                return None
+        if start_legal_move is None:
+            return node
+        return node.sliced(start_legal_move, max_legal_moves)
+
+    def new_store(self, board: chess.Board, start_legal_move=None, max_legal_moves=None):
+        store = NodeStore(self.max_nodes)
+        legal_moves = list(board.legal_moves)
+        if start_legal_move is not None:
+            legal_moves = legal_moves[start_legal_move:start_legal_move+max_legal_moves]
+        store.expand(0, legal_moves)
+        return store
+
+    def find_store_subtree(self, tree, board: chess.Board, start_legal_move):
+        # Same as find_subtree, but for a NodeStore. Only used when searching all root moves
+        if tree is None or start_legal_move is not None or tree[1] is not None:
+            return None
+        move_stack, _, _, store = tree
+        new_moves = board.move_stack[len(move_stack):]
+        if board.move_stack[:len(move_stack)] != move_stack or len(new_moves) > self.max_reuse_distance:
+            return None
+        node = 0
+        for move in new_moves:
+            node = store.find_child(node, move)
+            if node == NO_NODE:
+                return None
+        return store if node == 0 else store.extract_subtree(node)
+
+    def select_child_store(self, store: NodeStore, node):
+        visits = store.visits
+        first = store.first_child[node]
+        last = first + store.num_children[node]
+        min_visits = min(visits[first:last])
+        if min_visits < max(1, self.min_tries_per_node):
+            return random.choice([idx for idx in range(first, last) if visits[idx] == min_visits])
+        values = store.values
+        c = math.sqrt(2)
+        log_parent = math.log(visits[node])
+        return max(range(first, last), key=lambda idx: values[idx]/visits[idx] +
+                   c*math.sqrt(log_parent/visits[idx]))
+
+    def uct_store(self, board: chess.Board, is_white, store: NodeStore):
+        # Same as uct, but on a NodeStore and without recursion
+        node = 0
+        path = [node]
+        num_pushed = 0
+        result = None
+        while True:
+            result = self.terminal_result(board)
+            if result is not None:
+                break
+            elif num_pushed == 150:
+                result = 2
+                break
+            if not store.is_expanded(node):
+                legal_moves = self.timed('movegen', list, board.legal_moves)
+                if not store.expand(node, legal_moves):
+                    break
+                self.no_nodes += len(legal_moves)
+                if self.rollout_depth is not None:
+                    # Step into one of the new children and play the rest out from there
+                    node = self.timed('select', self.select_child_store, store, node)
+                    board.push(store.move(node))
+                    num_pushed += 1
+                    path.append(node)
+                    break
+            node = self.timed('select', self.select_child_store, store, node)
+            board.push(store.move(node))
+            num_pushed += 1
+            path.append(node)
+        self.max_level = max(self.max_level, num_pushed)
+        if result is None:
+            # Either a playout, or the store is full. Then finish the game with random moves
+            #   that aren't stored
+            if self.rollout_depth is None:
+                result = self.timed('evaluate', self.rollout, board, 150 - num_pushed, False)
+            else:
+                result = self.timed('evaluate', self.rollout, board, self.rollout_depth, True)
+        for _ in range(num_pushed):
+            board.pop()
+        if result < 2:
+            # See uct for how the values are counted
+            white_to_move = is_white
+            for node in path:
+                if white_to_move:
+                    store.values[node] += (1-result)
+                else:
+                    store.values[node] += result
+                store.visits[node] += 1
+                white_to_move = not white_to_move
+        return result
+
+    def get_shared_tree(self):
+        # One tree for all workers, kept between the moves since the processes are started
+        #   with it. The lock is only taken when a node is expanded
+        if self.shared_tree is None:
+            if self.tree_parallel == 'processes':
+                self.shared_tree = (NodeStore(self.max_nodes or 1000000, True), mp.Lock())
+            else:
+                self.shared_tree = (NodeStore(self.max_nodes or 1000000), threading.Lock())
+        return self.shared_tree
+
+    def descend_shared(self, board: chess.Board, store: NodeStore, lock):
+        # Walk down the shared tree, adding a virtual loss to the visited nodes, and expand
+        #   one leaf. Returns the path and the leaf position, or the result if the game is over
+        node = 0
+        path = [node]
+        store.visits[node] += self.virtual_loss
+        num_pushed = 0
+        result = None
+        while True:
+            result = self.terminal_result(board)
+            if result is not None:
+                break
+            elif num_pushed == 150:
+                result = win_probability(evaluate(board))
+                break
+            expanded = store.is_expanded(node)
+            if not expanded:
+                with lock:
+                    # Another worker might have expanded it while we waited for the lock
+                    if not store.is_expanded(node):
+                        legal_moves = self.timed('movegen', list, board.legal_moves)
+                        if store.expand(node, legal_moves):
+                            self.no_nodes += len(legal_moves)
+                if not store.is_expanded(node):
+                    # The store is full, play out from here
+                    break
+            node = self.timed('select', self.select_child_store, store, node)
+            store.visits[node] += self.virtual_loss
+            board.push(store.move(node))
+            num_pushed += 1
+            path.append(node)
+            if not expanded:
+                break
+        self.max_level = max(self.max_level, num_pushed)
+        leaf = board.copy() if result is None else None
+        for _ in range(num_pushed):
+            board.pop()
+        return path, leaf, result
+
+    def evaluate_leaves(self, batch):
+        # Results of the leaves of a batch that aren't known yet, all in one call
+        leaves = [leaf for _, leaf, result in batch if result is None]
+        if len(leaves) == 0:
+            return iter([])
+        return iter(win_probability(self.batch_evaluator.evaluate_boards(leaves)).tolist())
+
+    def uct_shared(self, board: chess.Board, is_white, store: NodeStore, lock):
+        # One batch of simulations on the shared tree
+        batch = [self.descend_shared(board, store, lock) for _ in range(self.batch_size)]
+        if self.batch_evaluator is not None:
+            leaf_results = self.timed('evaluate', self.evaluate_leaves, batch)
+        for path, leaf, result in batch:
+            if result is None and self.batch_evaluator is not None:
+                result = next(leaf_results)
+            elif result is None:
+                result = self.timed('evaluate', self.rollout, leaf, self.rollout_depth or 40, True)
+            # Replace the virtual loss by the real result. See uct for how values are counted
+            white_to_move = is_white
+            for node in path:
+                if white_to_move:
+                    store.values[node] += (1-result)
+                else:
+                    store.values[node] += result
+                store.visits[node] += 1 - self.virtual_loss
+                white_to_move = not white_to_move
+        return len(batch)
+
+    def run_it_shared(self, board: chess.Board, is_white: Boolean, store: NodeStore, lock, t_start, pid, out_queue):
+        self.reset()
+        while self.keep_searching(t_start):
+            self.no_simulations += self.uct_shared(board, is_white, store, lock)
+        out_queue.put((pid, [], self.worker_report(pid, [])))
+
+    def run_tree_parallel(self, board: chess.Board, is_white: Boolean, t_start, num_processes):
+        store, lock = self.get_shared_tree()
+        store.clear()
+        store.expand(0, list(board.legal_moves))
+        if self.tree_parallel == 'processes':
+            self.start_workers(num_processes)
+            for i in range(0, num_processes):
+                self.workers[i][1].put((board.copy(), is_white, t_start, self.budget, None, None))
+            out_queue = self.out_queue
+        else:
+            out_queue = queue.Queue()
+            threads = []
+            for i in range(0, num_processes):
+                # Every thread gets its own copy of the agent for the counters, and its own
+                #   profiler and playout board since those are changed during the search
+                agent = copy.copy(self)
+                agent.enable_profiling(self.profiler is not None)
+                agent.fast_board = FastBoard() if self.fast_board is not None else None
+                threads.append(threading.Thread(target=agent.run_it_shared, args=(
+                    board.copy(), is_white, store, lock, t_start, i+1, out_queue)))
+                threads[-1].start()
+            for thread in threads:
+                thread.join()
+        worker_reports = [out_queue.get()[2] for i in range(0, num_processes)]
+        return store.root_move_stats(), worker_reports, store.principal_variation(), store.memory_usage()
+
+    def terminal_result(self, board: chess.Board):
+        # Result for white if the game is over or the tablebase has the position, otherwise None
+        if self.tablebase is not None:
+            result = self.tablebase.result(board)
+            if result is not None:
+                return result
         if board.is_game_over():
-            return {'1-0': 1, '1/2-1/2': 0.5, '0-1': 0}[board.result()]
-        elif node.level == 150:
+            return results[board.result()]
+        return None
+
+    def rollout(self, board: chess.Board, max_plies, evaluate_cutoff):
+        # Play random moves, without recursion and without storing anything. Returns the
+        #   result for white, the static evaluation when max_plies is reached or 2 for no result
+        if self.fast_board is not None and self.tablebase is None:
+            return self.fast_rollout(board, max_plies, evaluate_cutoff)
+        num_pushed = 0
+        result = None
+        while num_pushed < max_plies:
+            if self.tablebase is not None:
+                # No need to play on once the tablebase knows the result
+                result = self.tablebase.result(board)
+                if result is not None:
+                    break
+            move = random_legal_move(board)
+            if move is None:
+                if board.is_check():
+                    result = 0 if board.turn == chess.WHITE else 1
+                else:
+                    result = 0.5
+                break
+            board.push(move)
+            num_pushed += 1
+        if result is None:
+            result = self.terminal_result(board)
+        if result is None:
+            result = win_probability(evaluate(board)) if evaluate_cutoff else 2
+        for _ in range(num_pushed):
+            board.pop()
+        return result
+
+    def fast_rollout(self, board: chess.Board, max_plies, evaluate_cutoff):
+        # Same as rollout, with make/unmake on the FastBoard. board isn't changed
+        fast_board = self.fast_board
+        fast_board.set_board(board)
+        result = None
+        # One move more than max_plies, to see if the game is over in the last position
+        for ply in range(max_plies + 1):
+            if fast_board.make_random_move() is None:
+                if fast_board.is_check():
+                    result = 0 if fast_board.turn else 1
+                else:
+                    result = 0.5
+                break
+            if ply == max_plies:
+                fast_board.unmake()
+        if result is None and (fast_board.halfmove_clock >= 150 or fast_board.is_insufficient_material()):
+            result = 0.5
+        if result is None:
+            result = win_probability(fast_board.score) if evaluate_cutoff else 2
+        return result
+
+    def uct_playout(self, board: chess.Board, is_white, root: ChessNode):
+        # Descend the tree until a new node is created, then play the rest out. Iterative,
+        #   with the same bookkeeping as uct
+        node = root
+        path = [(None, root)]
+        num_pushed = 0
+        while True:
+            result = self.terminal_result(board)
+            if result is not None:
+                break
+            elif node.level - self.root_level == 150:
+                result = win_probability(evaluate(board))
+                break
+            idx, child_node, cur_move, new_node_created = self.timed(
+                'select', node.get_child, board, self.min_tries_per_node)
+            board.push(cur_move)
+            num_pushed += 1
+            path.append((idx, child_node))
+            node = child_node
+            if new_node_created:
+                self.no_nodes += 1
+                result = self.timed('evaluate', self.rollout, board, self.rollout_depth, True)
+                break
+        self.max_level = max(self.max_level, node.level - self.root_level)
+        for _ in range(num_pushed):
+            board.pop()
+        # See uct for how the values are counted
+        white_to_move = is_white
+        parent = None
+        for idx, node in path:
+            if white_to_move:
+                node.value += (1-result)
+            else:
+                node.value += result
+            node.visits += 1
+            if parent is not None:
+                parent.child_visited(idx)
+            parent = node
+            white_to_move = not white_to_move
+        return result
+
+    def run_it_store(self, board: chess.Board, is_white: Boolean, store: NodeStore, t_start, pid, out_queue):
+        self.reset()
+        root_stats = None if self.split_root_moves else (
+            lambda: [(store.visits[child], store.values[child]) for child in store.children(0)])
+        while self.keep_searching(t_start, root_stats):
+            self.uct_store(board, is_white, store)
+            self.no_simulations += 1
+        out_queue.put((pid, store.root_move_stats(), self.worker_report(
+            pid, store.principal_variation(), store.memory_usage())))
+
+    def uct(self, board: chess.Board, is_white, node):
+        result = self.terminal_result(board)
+        if result is None and node.level - self.root_level == 150:
             return 2
-        else:
-            idx, child_node, cur_move, new_node_created = node.get_child(
-                board, self.min_tries_per_node)
+        elif result is None:
+            idx, child_node, cur_move, new_node_created = self.timed(
+                'select', node.get_child, board, self.min_tries_per_node)
             if new_node_created:
                 self.no_nodes += 1
-            self.max_level = max(self.max_level, child_node.level)
+            self.max_level = max(self.max_level, child_node.level - self.root_level)
             board.push(cur_move)
             result = self.uct(board, not is_white, child_node)
             board.pop()
-            # Black should get one point when black wins. Since the returned result for black win is 0,
-            #   we subtract it from 1. This will also handle the case of a draw
-            # Less than two: This is to keep a break at 150 moves (tweakable parameter)
             if result < 2:
-                if is_white:
-                    node.value += result
-                else:
-                    node.value += (1-result)
-                node.visits += 1
-            return result
+                node.child_visited(idx)
+        # The value of a node is from the point of view of the player that made the move to
+        #   the node, since that's the player choosing between it and its siblings. Black
+        #   should get one point when black wins. Since the returned result for black win is 0,
+        #   we subtract it from 1. This will also handle the case of a draw
+        # Less than two: This is to keep a break at 150 moves (tweakable parameter)
+        if result < 2:
+            if is_white:
+                node.value += (1-result)
+            else:
+                node.value += result
+            node.visits += 1
+        return result
 
     def run_it(self, board: chess.Board, is_white: Boolean, root_part: ChessNode, t_start, pid, out_queue):
-        print("Start job " + str(pid))
-        while (time.time()-t_start < self.t_max):
-            self.uct(board, is_white, root_part)
-        print("Finished loop for pid {}".format(pid))
-        idx_max, val_max = max([(idx, val.value/val.visits) for idx, val in enumerate(
-            root_part.children) if val and val.value > 0], key=operator.itemgetter(1))
-        for idx, node in enumerate(root_part.children):
-            if node == None:
-                print('Node %02d doesn\'t exist. Increase run time')
+        self.reset()
+        self.root_level = root_part.level
+        root_stats = None if self.split_root_moves else (
+            lambda: [(node.visits, node.value) if node else (0, 0.) for node in root_part.children])
+        while self.keep_searching(t_start, root_stats):
+            if self.rollout_depth is None:
+                self.uct(board, is_white, root_part)
             else:
-                print('Node %02d:\tValue: %.2f\tVisited:%d\tucb:%f' % (
-                    idx, node.value, node.visits, node.ucb_value(self.no_nodes)))
-        out_queue.put((root_part.legal_moves[idx_max], val_max))
-        print("End job " + str(pid))
+                self.uct_playout(board, is_white, root_part)
+            self.no_simulations += 1
+        # Statistics for every root move, to be merged with the other workers
+        move_stats = [(move, node.visits, node.value) for move, node in zip(
+            root_part.legal_moves, root_part.children) if node and node.visits > 0]
+        out_queue.put((pid, move_stats, self.worker_report(pid, root_part.principal_variation())))
+
+    def get_num_processes(self):
+        if self.num_processes:
+            return self.num_processes
+        # The number of CPUs this process may use, which can be less than the number of CPUs
+        try:
+            return len(os.sched_getaffinity(0))
+        except AttributeError:
+            return mp.cpu_count()
 
     def make_move(self, board: chess.Board, is_white: Boolean):
+        budget = self.start_clock(board)
+        self.budget = budget or (self.t_max, self.t_max)
+        move = self.known_move(board)
+        if move is None:
+            move = self.search(board, is_white)
+        self.stop_clock()
+        return move
+
+    def search(self, board: chess.Board, is_white: Boolean):
         t_start = time.time()
         self.reset()
-        #root = ChessNode(board, 0)
-        #print('The current system have {} CPUs of which {} are usable'.format(mp.cpu_count(),len(os.sched_getaffinity(0))))
-        max_num_processes = 3
         num_legal_moves = board.legal_moves.count()
-        legal_moves_per_process = math.ceil(num_legal_moves/max_num_processes)
-        processes = []
-        root_parts: List[ChessNode] = []
-        out_queue = mp.Queue()
-        print("Starting make_move")
-        # When there are few moves left, they might be all distributed among less than all processes.
-        #   Eg. with max_num_processes==3 and num_legal_moves==4, we get legal_moves_per_process==2
-        #   so we'll only use 2 processes.
-        num_processes = math.ceil(num_legal_moves/legal_moves_per_process)
-        for i in range(0, num_processes):
-            # Only create node if there are legal moves left to use
-            if num_legal_moves > legal_moves_per_process*i:
-                root_parts.append(ChessNode(board.copy(), 0, i *
-                                            legal_moves_per_process, legal_moves_per_process))
-                processes.append(mp.Process(target=self.run_it, args=(
-                    board.copy(), is_white, root_parts[-1], t_start, i+1, out_queue)))
-                processes[-1].start()
-        for p in processes:
-            p.join()
-        max_val, max_val_move = -math.inf, None
-        for i in range(0, num_processes):
-            cur_max_move, cur_max_val = out_queue.get()
-            print(cur_max_move, cur_max_val)
-            if cur_max_val > max_val:
-                max_val = cur_max_val
-                max_val_move = cur_max_move
-        print("Done with all the jobs")
-
-        move = max_val_move
-        print('Chose move {} with value/visits={}. Node count: {} Max depth: {}'.format
-              (max_val_move, max_val, self.no_nodes, self.max_level))
+        if num_legal_moves == 0:
+            return None
+        if num_legal_moves == 1:
+            # Nothing to choose between
+            move = next(iter(board.legal_moves))
+            self.update_stats(move, [move], 0, 0., [], t_start)
+            return move
+        max_num_processes = self.get_num_processes()
+        if self.tree_parallel:
+            move_stats, worker_reports, pv, memory = self.run_tree_parallel(
+                board, is_white, t_start, max_num_processes)
+            merged = {move: (visits, value) for move, visits, value in move_stats}
+        else:
+            merged, worker_reports = self.run_workers(board, is_white, t_start, max_num_processes)
+            pv = []
+            memory = None
+        self.merge_reports(worker_reports)
+        if len(merged) == 0:
+            # Not a single simulation finished in time, stats.simulations shows it
+            move = next(iter(board.legal_moves))
+            visits, value = 0, 0.
+        else:
+            if self.split_root_moves and not self.tree_parallel:
+                # The workers ran a different number of simulations, so compare the average values
+                move, (visits, value) = max(merged.items(), key=lambda x: x[1][1]/x[1][0])
+            else:
+                # Robust child: the move with the most visits, and the highest value on a tie
+                move, (visits, value) = max(merged.items(), key=lambda x: (x[1][0], x[1][1]))
+        if len(pv) == 0 or pv[0] != move:
+            # Use the principal variation of a worker that agrees on the move
+            pv = [move]
+            for report in worker_reports:
+                if report['pv'] and report['pv'][0] == move.uci():
+                    pv = [chess.Move.from_uci(uci) for uci in report['pv']]
+                    break
+        self.update_stats(move, pv, visits, value, worker_reports, t_start, memory)
         return move
 
+    def ponder(self, board: chess.Board, is_white: Boolean, stop_event):
+        # Let the workers search the opponent's position until stop_event is set
+        if self.tree_parallel or board.is_game_over():
+            return
+        t_start = time.time()
+        if self.in_process:
+            # Blocks until stop_event is set, and keeps the tree for the next move
+            out_queue = queue.Queue()
+            self.stop_event = stop_event
+            try:
+                self.local_tree = run_task(self, self.local_tree, (
+                    board.copy(), not is_white, None, self.budget, None, None), 0, out_queue)
+            finally:
+                self.stop_event = None
+            worker_reports = [out_queue.get()[2]]
+        else:
+            num_processes = self.send_tasks(board, not is_white, None, self.get_num_processes())
+            stop_event.wait()
+            self.stop_event.set()
+            worker_reports = [self.out_queue.get()[2] for i in range(0, num_processes)]
+            self.stop_event.clear()
+        # self.stats stays the one of the last move
+        self.merge_reports(worker_reports)
+        stats = self.stats
+        self.update_stats(None, [], 0, 0., worker_reports, t_start)
+        self.ponder_stats, self.stats = self.stats, stats
+
+    def merge_reports(self, worker_reports):
+        # The counters of the whole search, from those of the workers
+        self.no_nodes = sum(report['nodes'] for report in worker_reports)
+        self.no_simulations = sum(report['simulations'] for report in worker_reports)
+        self.max_level = max([report['max_level'] for report in worker_reports], default=0)
+
+    def send_tasks(self, board: chess.Board, is_white: Boolean, t_start, max_num_processes):
+        # Give the workers the position to search. Returns the number of workers used
+        num_legal_moves = board.legal_moves.count()
+        self.start_workers(max_num_processes)
+        if self.split_root_moves:
+            legal_moves_per_process = math.ceil(num_legal_moves/max_num_processes)
+            # When there are few moves left, they might be all distributed among less than all processes.
+            #   Eg. with max_num_processes==3 and num_legal_moves==4, we get legal_moves_per_process==2
+            #   so we'll only use 2 processes.
+            num_processes = math.ceil(num_legal_moves/legal_moves_per_process)
+            for i in range(0, num_processes):
+                # Worker i always gets the i:th part of the moves, so it can reuse its tree
+                self.workers[i][1].put((board.copy(), is_white, t_start, self.budget, i *
+                                        legal_moves_per_process, legal_moves_per_process))
+        else:
+            # Root parallel: every worker searches all the moves in its own tree
+            num_processes = max_num_processes
+            for i in range(0, num_processes):
+                self.workers[i][1].put((board.copy(), is_white, t_start, self.budget, None, None))
+        return num_processes
+
+    def run_workers(self, board: chess.Board, is_white: Boolean, t_start, max_num_processes):
+        # Search with the worker processes, each in its own tree. Returns the merged
+        #   (visits, value) per root move and the reports from the workers
+        if self.in_process:
+            out_queue = queue.Queue()
+            self.local_tree = run_task(self, self.local_tree, (
+                board.copy(), is_white, t_start, self.budget, None, None), 0, out_queue)
+            num_processes = 1
+        else:
+            num_processes = self.send_tasks(board, is_white, t_start, max_num_processes)
+            out_queue = self.out_queue
+        # Merge the statistics per move from all workers
+        merged = {}
+        worker_reports = []
+        for i in range(0, num_processes):
+            pid, move_stats, report = out_queue.get()
+            worker_reports.append(report)
+            for move, visits, value in move_stats:
+                old_visits, old_value = merged.get(move, (0, 0.))
+                merged[move] = (old_visits + visits, old_value + value)
+        return merged, worker_reports
+
+    def update_stats(self, move, pv, visits, value, worker_reports, t_start, memory=None):
+        # memory is that of the shared tree. Otherwise the trees of the workers are summed up
+        stats = SearchStats('AgentUCT')
+        stats.move = move
+        stats.nodes = self.no_nodes
+        stats.simulations = self.no_simulations
+        stats.depth = self.max_level
+        stats.time = time.time() - t_start
+        stats.pv = pv
+        stats.score = value/visits if visits > 0 else None
+        stats.workers = sorted(worker_reports, key=lambda x: x['pid'])
+        for report in worker_reports:
+            for phase, seconds in report['phases'].items():
+                stats.phases[phase] = stats.phases.get(phase, 0.) + seconds
+        if memory is None:
+            reports = [report['memory'] for report in worker_reports if report.get('memory')]
+            if reports:
+                memory = {key: sum(report[key] for report in reports) for key in reports[0]}
+        stats.memory = memory
+        self.stats = stats
+
 
 if __name__ == "__main__":
     print("Can't run this file directly")
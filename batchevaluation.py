@@ -0,0 +1,63 @@
+# Evaluation of many positions in one call with NumPy. The positions are given as the 12 piece
+#   bitboards, indexed as in evaluation.feature_index, which is also the layout of the
+#   records in dataset.py
+import numpy as np
+import chess
+from evaluation import square_values, move_features
+
+# Signed piece-square values as a (piece, square) table, white positive
+square_table = np.array(square_values, dtype=np.int64).reshape(12, 64)
+# np.unpackbits gives the bits of a little endian bitboard byte by byte, the highest bit of
+#   every byte first. The same table, in that order and flat
+unpacked_order = [(bit // 8) * 8 + 7 - bit % 8 for bit in range(64)]
+unpacked_table = square_table[:, unpacked_order].reshape(-1).astype(np.float64)
+
+
+def board_bitboards(board: chess.Board):
+    ret = [0] * 12
+    for piece_type in chess.PIECE_TYPES:
+        for color in chess.COLORS:
+            ret[(piece_type - 1) * 2 + color] = board.pieces_mask(piece_type, color)
+    return ret
+
+
+def boards_to_bitboards(boards):
+    # (number of boards, 12) array of bitboards
+    return np.array([board_bitboards(board) for board in boards], dtype=np.uint64).reshape(-1, 12)
+
+
+class BatchEvaluator:
+    """ Scores positions for white, the same as evaluation.evaluate, but for many positions in
+    one vectorized call. Everything goes through evaluate_bitboards, so a subclass that replaces
+    it (eg. with a trained model taking batches of bitboards) is used by the agents unchanged
+    """
+
+    def evaluate_bitboards(self, bitboards, turns):
+        # bitboards: (n, 12) uint64, turns: (n,) bool with True for white to move
+        bits = np.unpackbits(bitboards.astype('<u8').view(np.uint8)).reshape(len(bitboards), 12 * 64)
+        return (bits @ unpacked_table).astype(np.int64)
+
+    def evaluate_boards(self, boards):
+        turns = np.array([board.turn for board in boards], dtype=bool)
+        return self.evaluate_bitboards(boards_to_bitboards(boards), turns)
+
+    def evaluate_children(self, board: chess.Board, moves=None):
+        # Scores of the positions after each of the moves (all legal moves by default), without
+        #   pushing them. Returns the moves and the scores
+        if moves is None:
+            moves = list(board.legal_moves)
+        parent = board_bitboards(board)
+        children = []
+        for move in moves:
+            child = parent.copy()
+            removed, added = move_features(board, move)
+            for idx in removed + added:
+                child[idx >> 6] ^= 1 << (idx & 63)
+            children.append(child)
+        children = np.array(children, dtype=np.uint64).reshape(-1, 12)
+        turns = np.full(len(moves), not board.turn, dtype=bool)
+        return moves, self.evaluate_bitboards(children, turns)
+
+
+if __name__ == "__main__":
+    print("Can't run this file directly")
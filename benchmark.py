@@ -0,0 +1,262 @@
+# Benchmark suite for the agents. Runs every agent on a fixed set of positions with a fixed
+#   depth or number of simulations, and checks move generation with perft, both python-chess
+#   and the FastBoard of movegen.py against the known results.
+#
+#   $ python benchmark.py --output results.json
+#   $ python benchmark.py --compare baseline.json --threshold 0.1
+#   $ python benchmark.py --parallel 4
+#
+# The compare mode exits with a non-zero code when a metric got worse than the threshold
+#   compared to the baseline, so it can be used to gate changes
+import argparse
+import json
+import math
+import platform
+import queue
+import random
+import sys
+import time
+import tracemalloc
+import chess
+from agentminimax import AgentMinimax, compare_parallel
+from agentuct import AgentUCT, ChessNode
+from agentrandom import AgentRandom
+from movegen import FastBoard
+
+positions = {
+    'opening': chess.STARTING_FEN,
+    'middlegame': 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'tactical': 'r1b1kb1r/ppp2ppp/2n5/3qp3/8/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 6',
+    'endgame': '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1'}
+
+# Known perft results, see https://www.chessprogramming.org/Perft_Results
+perft_positions = [
+    (chess.STARTING_FEN, [20, 400, 8902, 197281]),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', [48, 2039, 97862]),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238]),
+    ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', [6, 264, 9467]),
+    ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [44, 1486, 62379])]
+
+# Metrics where a higher value is better. For the others, lower is better
+higher_is_better = {'nps', 'sims_per_sec'}
+compared_metrics = ['nps', 'sims_per_sec', 'time', 'peak_memory']
+# Runs faster than this (in seconds) are too noisy to compare the speed of
+min_compared_time = 0.1
+
+
+def perft(board: chess.Board, depth):
+    if depth == 1:
+        return board.legal_moves.count()
+    ret = 0
+    for move in board.legal_moves:
+        board.push(move)
+        ret += perft(board, depth-1)
+        board.pop()
+    return ret
+
+
+def measure(run, with_memory, repeats):
+    # Best time of repeats runs, since anything else running on the machine only makes a run
+    #   slower. The peak memory is measured in one more run since tracemalloc slows
+    #   everything down
+    elapsed = math.inf
+    for _ in range(repeats):
+        t_start = time.time()
+        result = run()
+        elapsed = min(elapsed, time.time() - t_start)
+    peak_memory = None
+    if with_memory:
+        tracemalloc.start()
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak_memory
+
+
+def bench_minimax(fen, depth, with_memory, repeats):
+    ret = {}
+    time_to_depth = []
+    for cur_depth in range(1, depth+1):
+        def run():
+            board = chess.Board(fen)
+            agent = AgentMinimax(cur_depth)
+            move = agent.make_move(board, board.turn)
+            return move, agent.no_nodes
+        (move, no_nodes), elapsed, peak_memory = measure(run, with_memory and cur_depth == depth, repeats)
+        time_to_depth.append(elapsed)
+    ret['depth'] = depth
+    ret['nodes'] = no_nodes
+    ret['time'] = elapsed
+    ret['nps'] = no_nodes / max(elapsed, 1e-9)
+    ret['time_to_depth'] = time_to_depth
+    ret['peak_memory'] = peak_memory
+    ret['move'] = move.uci() if move else None
+    return ret
+
+
+def bench_uct(fen, simulations, with_memory, repeats, **kwargs):
+    # Runs the search of one worker in this process, so no process start up is included
+    def run():
+        random.seed(0)
+        board = chess.Board(fen)
+        agent = AgentUCT(sys.float_info.max, 1, max_simulations=simulations, **kwargs)
+        out_queue = queue.Queue()
+        if agent.max_nodes:
+            agent.run_it_store(board, board.turn, agent.new_store(board), time.time(), 0, out_queue)
+        else:
+            agent.run_it(board, board.turn, ChessNode(board, 0), time.time(), 0, out_queue)
+        _, move_stats, report = out_queue.get()
+        move = max(move_stats, key=lambda x: (x[1], x[2]))[0] if move_stats else None
+        return move, report['nodes'], report['max_level']
+    (move, no_nodes, max_level), elapsed, peak_memory = measure(run, with_memory, repeats)
+    return {
+        'simulations': simulations,
+        'nodes': no_nodes,
+        'max_level': max_level,
+        'time': elapsed,
+        'nps': no_nodes / max(elapsed, 1e-9),
+        'sims_per_sec': simulations / max(elapsed, 1e-9),
+        'peak_memory': peak_memory,
+        'move': move.uci() if move else None}
+
+
+def bench_random(fen, with_memory, repeats):
+    def run():
+        random.seed(0)
+        board = chess.Board(fen)
+        return AgentRandom().make_move(board, board.turn)
+    move, elapsed, peak_memory = measure(run, with_memory, repeats)
+    return {'nodes': 1, 'time': elapsed, 'nps': 1 / max(elapsed, 1e-9),
+            'peak_memory': peak_memory, 'move': move.uci()}
+
+
+def bench_perft(max_depth):
+    ret = []
+    for fen, expected in perft_positions:
+        board = chess.Board(fen)
+        depth = min(max_depth, len(expected))
+        t_start = time.time()
+        nodes = perft(board, depth)
+        elapsed = time.time() - t_start
+        fast_board = FastBoard(board)
+        t_start = time.time()
+        fast_nodes = fast_board.perft(depth)
+        fast_elapsed = time.time() - t_start
+        ret.append({'fen': fen, 'depth': depth, 'nodes': nodes, 'expected': expected[depth-1],
+                    'ok': nodes == expected[depth-1], 'time': elapsed,
+                    'nps': nodes / max(elapsed, 1e-9),
+                    'fast_nodes': fast_nodes, 'fast_ok': fast_nodes == expected[depth-1],
+                    'fast_time': fast_elapsed, 'fast_nps': fast_nodes / max(fast_elapsed, 1e-9)})
+    return ret
+
+
+def run_suite(args):
+    with_memory = not args.no_memory
+    agents = {
+        'minimax': lambda fen: bench_minimax(fen, args.depth, with_memory, args.repeats),
+        'uct': lambda fen: bench_uct(fen, args.simulations, with_memory, args.repeats),
+        'uct_store': lambda fen: bench_uct(fen, args.simulations, with_memory, args.repeats,
+                                           max_nodes=200000),
+        'uct_fast': lambda fen: bench_uct(fen, args.simulations, with_memory, args.repeats,
+                                          fast_movegen=True),
+        'random': lambda fen: bench_random(fen, with_memory, args.repeats)}
+    results = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'python_chess': chess.__version__,
+        'settings': {'depth': args.depth, 'simulations': args.simulations, 'repeats': args.repeats,
+                     'perft_depth': args.perft_depth, 'parallel': args.parallel},
+        'runs': {},
+        'perft': bench_perft(args.perft_depth)}
+    for check in results['perft']:
+        print('perft {} depth {}: {} nodes ({}) {:.0f} nodes/s, FastBoard {} nodes ({}) {:.0f} nodes/s'.format(
+            check['fen'], check['depth'], check['nodes'], 'ok' if check['ok'] else 'FAILED', check['nps'],
+            check['fast_nodes'], 'ok' if check['fast_ok'] else 'FAILED', check['fast_nps']))
+    for agent_name, bench in agents.items():
+        if args.agents and agent_name not in args.agents:
+            continue
+        for position_name, fen in positions.items():
+            name = '{}/{}'.format(agent_name, position_name)
+            results['runs'][name] = bench(fen)
+            run = results['runs'][name]
+            line = '{:24} move {:6} nodes {:8} time {:7.3f}s {:10.0f} nodes/s'.format(
+                name, str(run['move']), run['nodes'], run['time'], run['nps'])
+            if 'sims_per_sec' in run:
+                line += ' {:8.0f} simulations/s'.format(run['sims_per_sec'])
+            print(line)
+    if args.parallel:
+        # Speedup of AgentMinimax with the root moves split over args.parallel processes
+        results['parallel'] = {}
+        for position_name, fen in positions.items():
+            run = compare_parallel(chess.Board(fen), args.depth, args.parallel)
+            results['parallel'][position_name] = run
+            print('{:24} single {:7.3f}s parallel {:7.3f}s with {} workers, speedup {:.2f}'.format(
+                'minimax_parallel/' + position_name, run['single']['time'], run['parallel']['time'],
+                run['num_workers'], run['speedup']))
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Returns the list of regressions: metrics that got worse by more than threshold
+    regressions = []
+    for check in results['perft']:
+        if not check['ok']:
+            regressions.append('perft {} depth {} gave {} nodes, expected {}'.format(
+                check['fen'], check['depth'], check['nodes'], check['expected']))
+        if not check.get('fast_ok', True):
+            regressions.append('FastBoard perft {} depth {} gave {} nodes, expected {}'.format(
+                check['fen'], check['depth'], check['fast_nodes'], check['expected']))
+    for name, run in results['runs'].items():
+        old = baseline['runs'].get(name)
+        if old is None:
+            continue
+        for metric in compared_metrics:
+            if run.get(metric) is None or not old.get(metric):
+                continue
+            if metric in ('nps', 'sims_per_sec', 'time') and old['time'] < min_compared_time:
+                continue
+            change = (run[metric] - old[metric]) / old[metric]
+            if metric in higher_is_better:
+                change = -change
+            if change > threshold:
+                regressions.append('{} {}: {:.4g} -> {:.4g} ({:+.1f}% worse)'.format(
+                    name, metric, old[metric], run[metric], change*100))
+        if run.get('move') != old.get('move'):
+            print('{}: move changed from {} to {}'.format(name, old.get('move'), run.get('move')))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the chess agents')
+    parser.add_argument('--output', default='benchmark.json', help='Where to write the results')
+    parser.add_argument('--compare', help='Baseline results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Allowed relative regression before failing, eg. 0.1 for 10%%')
+    parser.add_argument('--depth', type=int, default=3, help='Depth for AgentMinimax')
+    parser.add_argument('--simulations', type=int, default=500, help='Simulations for AgentUCT')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per measurement, the best time is kept')
+    parser.add_argument('--perft-depth', type=int, default=3, help='Max depth for perft')
+    parser.add_argument('--parallel', type=int,
+                        help='Also measure the speedup of AgentMinimax with this many worker processes')
+    parser.add_argument('--agents', nargs='*', help='Only run these agents')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the peak memory runs')
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION: ' + regression)
+        if regressions:
+            sys.exit(1)
+        print('No regressions compared to {}'.format(args.compare))
+
+
+if __name__ == "__main__":
+    main()
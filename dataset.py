@@ -0,0 +1,211 @@
+# Training positions from PGN files, in a binary format that can be memory mapped
+#
+#   $ python dataset.py --output data/positions games1.pgn games2.pgn
+#
+# The PGN files are split into chunks at game boundaries and the chunks are parsed by a pool
+#   of processes. Every position before a move becomes one fixed size record with the pieces
+#   as bitboards, the move that was played and the result of the game. A position that was
+#   seen before (by Zobrist key) is skipped. Three files are written:
+#   positions.bin         the records, one after the other
+#   positions.index.npy   the first record and the number of records of every game
+#   positions.json        the number of records and games, and the record layout
+import argparse
+import io
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import chess
+import chess.pgn
+import chess.polyglot
+from mctstree import encode_move, decode_move
+
+record_dtype = np.dtype([
+    ('key', '<u8'),
+    # Bitboard per piece, indexed as in evaluation.feature_index
+    ('bitboards', '<u8', (12,)),
+    # The squares of the rooks that can castle, as chess.Board.castling_rights
+    ('castling', '<u8'),
+    # See mctstree.encode_move
+    ('move', '<u2'),
+    ('ply', '<u2'),
+    ('ep_square', 'i1'),
+    ('turn', 'u1'),
+    # 1 when white won, 0 for a draw and -1 when black won
+    ('result', 'i1'),
+    ('halfmove_clock', 'u1')])
+index_dtype = np.dtype([('start', '<u8'), ('count', '<u4')])
+
+results = {'1-0': 1, '1/2-1/2': 0, '0-1': -1}
+game_start = b'\n[Event '
+
+
+def find_chunks(path, chunk_size):
+    # Split a PGN file into (path, start, end) at the start of games, about chunk_size bytes each
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        while offsets[-1] + chunk_size < size:
+            f.seek(offsets[-1] + chunk_size)
+            pos = f.tell()
+            found = -1
+            while found == -1:
+                block = f.read(1 << 16)
+                if not block:
+                    break
+                found = block.find(game_start)
+                if found == -1:
+                    if len(block) <= len(game_start):
+                        break
+                    # The marker may be split between two blocks
+                    pos += len(block) - len(game_start)
+                    f.seek(pos)
+            if found == -1:
+                break
+            offsets.append(pos + found + 1)
+    offsets.append(size)
+    return [(path, start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+
+def board_record(board: chess.Board, move: chess.Move, result):
+    # One record with the position before the move, as a tuple in the order of record_dtype
+    bitboards = [0] * 12
+    for piece_type in chess.PIECE_TYPES:
+        for color in chess.COLORS:
+            bitboards[(piece_type - 1) * 2 + color] = board.pieces_mask(piece_type, color)
+    return (chess.polyglot.zobrist_hash(board), bitboards, board.castling_rights,
+            encode_move(move), len(board.move_stack),
+            -1 if board.ep_square is None else board.ep_square,
+            board.turn, result, min(board.halfmove_clock, 255))
+
+
+def parse_chunk(task):
+    # Parse the games of one chunk. Returns the records and the number of records per game
+    path, start, end, skip_plies = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8', errors='replace')
+    pgn = io.StringIO(text)
+    records = []
+    game_lengths = []
+    while True:
+        game = chess.pgn.read_game(pgn)
+        if game is None:
+            break
+        result = results.get(game.headers.get('Result'))
+        if result is None or game.errors:
+            continue
+        board = game.board()
+        num_records = 0
+        for ply, move in enumerate(game.mainline_moves()):
+            if ply >= skip_plies:
+                records.append(board_record(board, move, result))
+                num_records += 1
+            board.push(move)
+        game_lengths.append(num_records)
+    return np.array(records, dtype=record_dtype), game_lengths, end - start
+
+
+def ingest(pgn_paths, output, num_processes=None, chunk_size=16 << 20, skip_plies=0):
+    chunks = []
+    for path in pgn_paths:
+        chunks += [chunk + (skip_plies,) for chunk in find_chunks(path, chunk_size)]
+    total_bytes = sum(end - start for _, start, end, _ in chunks)
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    seen = set()
+    index = []
+    num_records = 0
+    num_positions = 0
+    num_bytes = 0
+    t_start = time.time()
+    with mp.Pool(num_processes) as pool, open(output + '.bin', 'wb') as f:
+        for records, game_lengths, chunk_bytes in pool.imap_unordered(parse_chunk, chunks):
+            # Keep the first record of every position
+            keep = np.zeros(len(records), dtype=bool)
+            for i, key in enumerate(records['key'].tolist()):
+                if key not in seen:
+                    seen.add(key)
+                    keep[i] = True
+            start = 0
+            for game_length in game_lengths:
+                count = int(keep[start:start+game_length].sum())
+                index.append((num_records, count))
+                num_records += count
+                start += game_length
+            f.write(records[keep].tobytes())
+            num_positions += len(records)
+            num_bytes += chunk_bytes
+            elapsed = max(time.time() - t_start, 1e-9)
+            print('{:.1%}: {} games, {} positions, {} unique. {:.1f} MB/s, {:.0f} positions/s'.format(
+                num_bytes / max(total_bytes, 1), len(index), num_positions, num_records,
+                num_bytes / elapsed / 1e6, num_positions / elapsed))
+    np.save(output + '.index.npy', np.array(index, dtype=index_dtype))
+    with open(output + '.json', 'w') as f:
+        json.dump({'records': num_records, 'games': len(index), 'positions': num_positions,
+                   'dtype': record_dtype.descr}, f, indent=2)
+    print('Wrote {} positions from {} games to {} in {:.1f}s'.format(
+        num_records, len(index), output, time.time() - t_start))
+    return num_records
+
+
+class PositionDataset:
+    """ The records written by ingest, memory mapped. Only the records that are used are read
+    from the disk
+    """
+
+    def __init__(self, path):
+        with open(path + '.json') as f:
+            self.info = json.load(f)
+        num_records = self.info['records']
+        self.records = np.memmap(path + '.bin', dtype=record_dtype, mode='r', shape=(num_records,)) \
+            if num_records else np.zeros(0, dtype=record_dtype)
+        self.index = np.load(path + '.index.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.records)
+
+    def sample(self, batch_size, rng=np.random):
+        # Random records. The indices are sorted so the reads go forward through the file
+        return self.records[np.sort(rng.randint(0, len(self.records), batch_size))]
+
+    def game(self, game_number):
+        start, count = self.index[game_number]
+        return self.records[start:start+count]
+
+
+def record_to_board(record):
+    # The position of a record, without the moves before it
+    board = chess.Board(None)
+    for piece_type in chess.PIECE_TYPES:
+        for color in chess.COLORS:
+            for square in chess.SquareSet(int(record['bitboards'][(piece_type - 1) * 2 + color])):
+                board.set_piece_at(square, chess.Piece(piece_type, color))
+    board.turn = bool(record['turn'])
+    board.castling_rights = int(record['castling'])
+    board.ep_square = None if record['ep_square'] < 0 else int(record['ep_square'])
+    board.halfmove_clock = int(record['halfmove_clock'])
+    board.fullmove_number = int(record['ply']) // 2 + 1
+    return board
+
+
+def record_move(record):
+    return decode_move(int(record['move']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract training positions from PGN files')
+    parser.add_argument('pgn', nargs='+', help='PGN files with the games')
+    parser.add_argument('--output', default='positions', help='Path of the output files, without extension')
+    parser.add_argument('--processes', type=int, help='Number of processes, by default one per CPU')
+    parser.add_argument('--chunk-mb', type=float, default=16, help='Size of the chunks of PGN')
+    parser.add_argument('--skip-plies', type=int, default=0, help='Leave out the first plies of every game')
+    args = parser.parse_args()
+    ingest(args.pgn, args.output, args.processes, int(args.chunk_mb * (1 << 20)), args.skip_plies)
+
+
+if __name__ == "__main__":
+    main()
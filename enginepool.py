@@ -0,0 +1,353 @@
+# A bounded pool of engine processes, shared by all the games on the server
+import atexit
+import itertools
+import os
+import threading
+import multiprocessing as mp
+import multiprocessing.connection
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from agentbase import AgentBase
+from agentminimax import AgentMinimax
+from agentuct import AgentUCT
+from agentrandom import AgentRandom
+
+# The options a client may set per agent type, with their type and the range the server
+#   allows, so one game can't take all the memory or keep a process busy for long
+agent_options = {
+    'minimax': {'depth': (int, 1, 4), 't_max': (float, 0.1, 60), 'max_nodes': (int, 1, 1000000),
+                'tt_size_mb': (int, 1, 64), 'aspiration_window': (int, 0, 1000)},
+    'uct': {'t_max': (float, 0.1, 60), 'min_tries_per_node': (int, 1, 100),
+            'max_nodes': (int, 1000, 2000000), 'rollout_depth': (int, 1, 150),
+            'max_simulations': (int, 1, 1000000), 'fast_movegen': (bool, 0, 1)},
+    'random': {}}
+# The JSON types accepted for each type of option
+option_types = {int: (int,), float: (int, float), bool: (bool, int)}
+# Seconds between the checks for engine processes that died
+check_interval = 1
+# Seconds a game waits for its move before it gives up on the process
+move_timeout = 300
+# Requests a game may have in the pool at once. A game only needs one, the move it waits for
+max_requests_per_game = 1
+
+
+class EngineDied(Exception):
+    # Set on the requests of an engine process that died before it answered them
+    pass
+
+
+class EngineBusy(Exception):
+    # Raised when a game asks for more moves than max_requests_per_game at once
+    pass
+
+
+def valid_options(agent_type, options):
+    # True when every option is known for the agent type, of its type and within its range
+    allowed = agent_options.get(agent_type)
+    if allowed is None:
+        return False
+    for key, value in options.items():
+        if key not in allowed:
+            return False
+        kind, low, high = allowed[key]
+        if type(value) not in option_types[kind] or not low <= value <= high:
+            return False
+    return True
+
+
+def create_agent(agent_type, options):
+    # Agent that searches in the calling process, since every engine process runs one
+    #   search at a time. Daemon processes can't start processes of their own either
+    options = {key: value for key, value in options.items() if key in agent_options[agent_type]}
+    if agent_type == 'minimax':
+        return AgentMinimax(options.pop('depth', None), num_workers=1, **options)
+    elif agent_type == 'uct':
+        return AgentUCT(options.pop('t_max', 10), options.pop('min_tries_per_node', 10),
+                        in_process=True, **options)
+    else:
+        return AgentRandom()
+
+
+def engine_worker(task_queue, results, stop_flag, sent, taken):
+    # Keeps the agents of the games assigned to this process, so the transposition tables and
+    #   trees are kept between the moves. A task without request id is a ponder task, see
+    #   EnginePool.ponder. sent - taken is the number of other tasks in the queue, and
+    #   stop_flag is set when one is added
+    agents = {}
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        request_id, game_id, payload = task
+        if request_id is not None or payload is None:
+            taken.value += 1
+        if payload is None:
+            # The game is over
+            for key in [key for key in agents if key[0] == game_id]:
+                agent = agents.pop(key)
+                if hasattr(agent, 'close'):
+                    agent.close()
+            continue
+        is_white, agent_type, options, board = payload
+        if request_id is None:
+            stop_flag.clear()
+            if sent.value > taken.value:
+                # Other games are waiting, or the game itself asked for its move already
+                continue
+        try:
+            key = (game_id, is_white)
+            if key not in agents:
+                agents[key] = create_agent(agent_type, options)
+            agent = agents[key]
+            if request_id is None:
+                agent.ponder(board, is_white, stop_flag)
+            else:
+                move = agent.make_move(board, is_white)
+                results.send((request_id, (move, agent.stats), None))
+        except Exception as e:
+            if request_id is None:
+                print("Pondering failed: {}".format(e))
+            else:
+                results.send((request_id, None, e))
+
+
+class StopFlag:
+    # Stops the ponder search of a process, like an Event. It's a plain byte in shared memory,
+    #   since a process that is killed while it holds the lock of an Event blocks everyone
+    #   else that uses it
+    def __init__(self):
+        self.flag = mp.RawValue('b', 0)
+
+    def set(self):
+        self.flag.value = 1
+
+    def clear(self):
+        self.flag.value = 0
+
+    def is_set(self):
+        return self.flag.value == 1
+
+
+class EngineWorker:
+    # One engine process and everything it shares with the pool. Nothing is shared with the
+    #   other processes, and nothing has a lock the process could die holding: the results
+    #   come back on a pipe of its own, and each counter has only one writer
+    def __init__(self):
+        self.task_queue = mp.Queue()
+        self.stop_flag = StopFlag()
+        # Tasks put in the queue by the pool and taken by the process, not counting pondering
+        self.sent = mp.RawValue('q', 0)
+        self.taken = mp.RawValue('q', 0)
+        self.results, results_writer = mp.Pipe(duplex=False)
+        self.process = mp.Process(target=engine_worker, daemon=True, args=(
+            self.task_queue, results_writer, self.stop_flag, self.sent, self.taken))
+        self.process.start()
+        # Then only the process has the other end, and reading fails once it is gone
+        results_writer.close()
+
+    def put_task(self, task):
+        # Counted before it is queued and the ponder search stopped after, so the process
+        #   can't start pondering with the task in its queue. Call with the lock of the pool
+        #   held, since that's the only writer of sent
+        self.sent.value += 1
+        self.task_queue.put(task)
+        self.stop_flag.set()
+
+
+class EnginePool:
+    """ All engine searches of the server go to a fixed number of processes, by default one
+    per usable CPU, so the number of games doesn't decide the number of processes
+
+    A game is assigned to the least busy process when it first asks for a move, and stays there
+    so its agents keep their state. Every process serves its queue in order, and a game can only
+    have max_requests_per_game requests in it, so the games of a process take turns. When the
+    process of a game is busy with other games and another process is idle, the game moves to
+    the idle one: starting over with a new agent is quicker than waiting for a long search
+
+    A process that dies is replaced by a new one. Its open requests fail with EngineDied and its
+    games are assigned again on their next request
+
+    While a human thinks, the game can let its process ponder. The process stops pondering as
+    soon as it gets another task, so it never keeps other games waiting
+    """
+
+    def __init__(self, num_processes=None):
+        self.num_processes = num_processes
+        self.workers = []
+        # game id -> index of the worker
+        self.assignments = {}
+        # request id -> (future, index of the worker, game id)
+        self.futures = {}
+        self.request_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.collector_stop = None
+
+    def get_num_processes(self):
+        if self.num_processes:
+            return self.num_processes
+        try:
+            return len(os.sched_getaffinity(0))
+        except AttributeError:
+            return mp.cpu_count()
+
+    def start(self):
+        self.workers = [EngineWorker() for _ in range(self.get_num_processes())]
+        self.collector_stop = threading.Event()
+        collector = threading.Thread(target=self.collect, args=(self.collector_stop,), daemon=True)
+        collector.start()
+        # multiprocessing ends the processes at exit, after this. They must not be restarted
+        atexit.register(self.collector_stop.set)
+
+    def collect(self, collector_stop):
+        # Hand the results from the processes to the waiting games, until the pool is closed
+        while not collector_stop.is_set():
+            with self.lock:
+                workers = list(self.workers)
+            # A process that ends wakes us up through its sentinel
+            ready = mp.connection.wait([worker.results for worker in workers] +
+                                       [worker.process.sentinel for worker in workers],
+                                       timeout=check_interval)
+            for worker in workers:
+                if worker.results not in ready:
+                    continue
+                try:
+                    request_id, result, error = worker.results.recv()
+                except (EOFError, OSError):
+                    # The process is gone, see check_workers
+                    continue
+                with self.lock:
+                    future, _, _ = self.futures.pop(request_id, (None, None, None))
+                if future is None:
+                    # Already failed, the process died after it sent the result
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+            self.check_workers()
+
+    def check_workers(self):
+        # Replace the processes that died, eg. killed for using too much memory. Nothing
+        #   would ever answer the requests in their queues
+        failed = []
+        with self.lock:
+            if self.collector_stop.is_set():
+                return
+            for idx, worker in enumerate(self.workers):
+                if worker.process.is_alive():
+                    continue
+                print("Engine process {} died with exit code {}, restarting".format(
+                    idx, worker.process.exitcode))
+                worker.results.close()
+                self.workers[idx] = EngineWorker()
+                for request_id in [request_id for request_id, (_, worker_idx, _) in self.futures.items()
+                                   if worker_idx == idx]:
+                    failed.append(self.futures.pop(request_id)[0])
+                for game_id in [game_id for game_id, worker_idx in self.assignments.items()
+                                if worker_idx == idx]:
+                    del self.assignments[game_id]
+        for future in failed:
+            future.set_exception(EngineDied('The engine process died during the search'))
+
+    def assign(self, game_id, rebalance=True):
+        # Index of the worker of the game. Call with the lock held
+        if len(self.workers) == 0:
+            self.start()
+        # Open requests and games per worker. The least busy worker has the fewest of both
+        requests = [0] * len(self.workers)
+        for _, idx, _ in self.futures.values():
+            requests[idx] += 1
+        games = [0] * len(self.workers)
+        for idx in self.assignments.values():
+            games[idx] += 1
+        least_busy = min(range(len(self.workers)), key=lambda idx: (requests[idx], games[idx]))
+        idx = self.assignments.get(game_id)
+        if idx is None:
+            self.assignments[game_id] = least_busy
+        elif rebalance and requests[idx] > 0 and requests[least_busy] == 0:
+            # The agents of the game are dropped in the process it leaves
+            self.workers[idx].put_task((None, game_id, None))
+            self.assignments[game_id] = least_busy
+        return self.assignments[game_id]
+
+    def submit(self, game_id, is_white, agent_type, options, board):
+        # Returns a Future with (move, stats)
+        future = Future()
+        with self.lock:
+            if sum(1 for _, _, other in self.futures.values()
+                   if other == game_id) >= max_requests_per_game:
+                raise EngineBusy('Game {} already has {} requests in the pool'.format(
+                    game_id, max_requests_per_game))
+            idx = self.assign(game_id)
+            request_id = next(self.request_ids)
+            self.futures[request_id] = (future, idx, game_id)
+            self.workers[idx].put_task(
+                (request_id, game_id, (is_white, agent_type, options, board.copy())))
+        return future
+
+    def wait(self, future):
+        # The result of a request. Raises EngineDied when there is none in time, eg. because
+        #   the process hangs, so the game doesn't wait forever
+        try:
+            return future.result(timeout=move_timeout)
+        except FutureTimeoutError:
+            with self.lock:
+                for request_id in [request_id for request_id, (other, _, _) in self.futures.items()
+                                   if other is future]:
+                    del self.futures[request_id]
+            raise EngineDied('No result from the engine process in {}s'.format(move_timeout))
+
+    def ponder(self, game_id, is_white, agent_type, options, board):
+        # Let the agent search board, where the opponent is to move, until the next task for
+        #   its process. Returns right away
+        with self.lock:
+            task_queue = self.workers[self.assign(game_id, rebalance=False)].task_queue
+        task_queue.put((None, game_id, (is_white, agent_type, options, board.copy())))
+
+    def release(self, game_id):
+        # Drop the agents of a game that is over
+        with self.lock:
+            idx = self.assignments.pop(game_id, None)
+            if idx is not None:
+                self.workers[idx].put_task((None, game_id, None))
+
+    def close(self):
+        with self.lock:
+            workers, self.workers = self.workers, []
+            if self.collector_stop is not None:
+                self.collector_stop.set()
+        for worker in workers:
+            worker.task_queue.put(None)
+            worker.stop_flag.set()
+        for worker in workers:
+            worker.process.join()
+
+
+class PooledAgent(AgentBase):
+    # Stands in for an agent that searches in the engine pool
+    def __init__(self, pool, game_id, agent_type, options={}):
+        super(PooledAgent, self).__init__()
+        self.pool = pool
+        self.game_id = game_id
+        self.agent_type = agent_type
+        self.options = options
+
+    def request_move(self, board, is_white):
+        return self.pool.wait(self.pool.submit(
+            self.game_id, is_white, self.agent_type, self.options, board))
+
+    def make_move(self, board, is_white):
+        try:
+            move, self.stats = self.request_move(board, is_white)
+        except EngineDied:
+            # Once more, in the process the game is assigned to now. The agent starts over there
+            move, self.stats = self.request_move(board, is_white)
+        return move
+
+    def ponder(self, board, is_white, stop_event=None):
+        # The search runs in the engine pool until the next move of the game is asked for, so
+        #   this returns right away and stop_event isn't needed
+        self.pool.ponder(self.game_id, is_white, self.agent_type, self.options, board)
+
+
+if __name__ == "__main__":
+    print("Can't run this file directly")
@@ -0,0 +1,204 @@
+# Static evaluation shared by the agents, based on
+# https://www.chessprogramming.org/Simplified_Evaluation_Function
+import chess
+import chess.polyglot
+
+# In the maps below, index 0 = A8 and index 63 = H1
+pawn_map_black = [
+    0, 0, 0, 0, 0, 0, 0, 0, 50, 50, 50, 50, 50, 50, 50, 50, 10, 10, 20, 30, 30, 20, 10, 10, 5, 5, 10, 25, 25, 10, 5, 5, 0, 0, 0, 20, 20, 0, 0, 0, 5, -5, -10, 0, 0, -10, -5, 5, 5, 10, 10, -20, -20, 10, 10, 5, 0, 0, 0, 0, 0, 0, 0, 0]
+knight_map_black = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,  0,  0,  0,  0, -20, -40,
+    -30,  0, 10, 15, 15, 10,  0, -30,
+    -30,  5, 15, 20, 20, 15,  5, -30,
+    -30,  0, 15, 20, 20, 15,  0, -30,
+    -30,  5, 10, 15, 15, 10,  5, -30,
+    -40, -20,  0,  5,  5,  0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+bishop_map_black = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,  0,  0,  0,  0,  0,  0, -10,
+    -10,  0,  5, 10, 10,  5,  0, -10,
+    -10,  5,  5, 10, 10,  5,  5, -10,
+    -10,  0, 10, 10, 10, 10,  0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10,  5,  0,  0,  0,  0,  5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+rook_map_black = [
+    0,  0,  0,  0,  0,  0,  0,  0,
+    5, 10, 10, 10, 10, 10, 10,  5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    0,  0,  0,  5,  5,  0,  0,  0]
+queen_map_black = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10,  0,  0,  0,  0,  0,  0, -10,
+    -10,  0,  5,  5,  5,  5,  0, -10,
+    -5,  0,  5,  5,  5,  5,  0, -5,
+    0,  0,  5,  5,  5,  5,  0, -5,
+    -10,  5,  5,  5,  5,  5,  0, -10,
+    -10,  0,  5,  0,  0,  0,  0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20]
+king_map_black = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20,  0,  0,  0,  0, 20, 20,
+    20, 30, 10,  0,  0, 10, 30, 20]
+
+
+
+piece_values = {
+    chess.PAWN: 100,
+    chess.KNIGHT: 320,
+    chess.BISHOP: 330,
+    chess.ROOK: 500,
+    chess.QUEEN: 900,
+    chess.KING: 20000}
+
+piece_maps_black = {
+    chess.PAWN: pawn_map_black,
+    chess.KNIGHT: knight_map_black,
+    chess.BISHOP: bishop_map_black,
+    chess.ROOK: rook_map_black,
+    chess.QUEEN: queen_map_black,
+    chess.KING: king_map_black}
+
+
+def feature_index(piece_type, color, square):
+    # Index into the flat tables below. Pieces are numbered 0-11 with black pieces
+    #   at even and white pieces at odd positions (same order as Polyglot uses)
+    return ((piece_type - 1) * 2 + color) * 64 + square
+
+
+def build_square_values():
+    # Material + position for every (piece, square), signed so that white is positive.
+    #   Index 0 = A1, index 63 = H8 in the python-chess lib. So, invert for white pieces
+    values = [0] * (12 * 64)
+    for piece_type, piece_map in piece_maps_black.items():
+        for square in chess.SQUARES:
+            values[feature_index(piece_type, chess.WHITE, square)] = \
+                piece_values[piece_type] + piece_map[63 - square]
+            values[feature_index(piece_type, chess.BLACK, square)] = \
+                -(piece_values[piece_type] + piece_map[square])
+    return values
+
+
+square_values = build_square_values()
+
+# Zobrist keys use the same feature indexing as Polyglot, so keys match chess.polyglot.zobrist_hash
+zobrist_hasher = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+zobrist_pieces = chess.polyglot.POLYGLOT_RANDOM_ARRAY[:12 * 64]
+zobrist_turn = chess.polyglot.POLYGLOT_RANDOM_ARRAY[780]
+
+
+def evaluate(board: chess.Board):
+    # Full evaluation from scratch: value for white minus value for black
+    ret = 0
+    for color in chess.COLORS:
+        for piece_type in chess.PIECE_TYPES:
+            offset = feature_index(piece_type, color, 0)
+            for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                ret += square_values[offset + square]
+    return ret
+
+
+def move_features(board: chess.Board, move: chess.Move):
+    # Features removed and added when the move is played on the board. The move must be
+    #   pseudo-legal in the current position and is not pushed
+    color = board.turn
+    from_square = move.from_square
+    to_square = move.to_square
+    piece_type = board.piece_type_at(from_square)
+    removed = [feature_index(piece_type, color, from_square)]
+    if piece_type == chess.KING and board.is_castling(move):
+        rank = 0 if color == chess.WHITE else 56
+        if chess.square_file(to_square) > chess.square_file(from_square):
+            king_to, rook_from, rook_to = rank + 6, rank + 7, rank + 5
+        else:
+            king_to, rook_from, rook_to = rank + 2, rank + 0, rank + 3
+        removed.append(feature_index(chess.ROOK, color, rook_from))
+        added = [feature_index(chess.KING, color, king_to),
+                 feature_index(chess.ROOK, color, rook_to)]
+        return removed, added
+    captured_type = board.piece_type_at(to_square)
+    if captured_type:
+        removed.append(feature_index(captured_type, not color, to_square))
+    elif piece_type == chess.PAWN and to_square == board.ep_square:
+        capture_square = to_square - 8 if color == chess.WHITE else to_square + 8
+        removed.append(feature_index(chess.PAWN, not color, capture_square))
+    added = [feature_index(move.promotion or piece_type, color, to_square)]
+    return removed, added
+
+
+class IncrementalEvaluator:
+    """ Keeps the evaluation and the Zobrist key of a board up to date while moves are pushed
+    and popped. All moves must go through push/pop of this class for them to stay in sync
+    """
+
+    def __init__(self):
+        self.score = 0
+        self.key = 0
+        self.history = []
+        self.castling_keys = {}
+
+    def reset(self, board: chess.Board):
+        self.score = evaluate(board)
+        self.key = chess.polyglot.zobrist_hash(board)
+        self.history.clear()
+
+    def castling_key(self, board: chess.Board):
+        # Castling rights only take a handful of values during a game, so cache their keys
+        key = self.castling_keys.get(board.castling_rights)
+        if key is None:
+            key = zobrist_hasher.hash_castling(board)
+            self.castling_keys[board.castling_rights] = key
+        return key
+
+    def delta(self, board: chess.Board, move: chess.Move):
+        # Change in score if the move was played, without touching the board
+        if not move:
+            return 0
+        removed, added = move_features(board, move)
+        ret = 0
+        for idx in added:
+            ret += square_values[idx]
+        for idx in removed:
+            ret -= square_values[idx]
+        return ret
+
+    def push(self, board: chess.Board, move: chess.Move):
+        self.history.append((self.score, self.key))
+        key = self.key
+        if move:
+            removed, added = move_features(board, move)
+            for idx in added:
+                self.score += square_values[idx]
+                key ^= zobrist_pieces[idx]
+            for idx in removed:
+                self.score -= square_values[idx]
+                key ^= zobrist_pieces[idx]
+        castling_rights = board.castling_rights
+        castling_key = self.castling_key(board)
+        if board.ep_square is not None:
+            key ^= zobrist_hasher.hash_ep_square(board)
+        board.push(move)
+        if board.ep_square is not None:
+            key ^= zobrist_hasher.hash_ep_square(board)
+        if board.castling_rights != castling_rights:
+            key ^= castling_key ^ self.castling_key(board)
+        self.key = key ^ zobrist_turn
+
+    def pop(self, board: chess.Board):
+        self.score, self.key = self.history.pop()
+        return board.pop()
+
+
+if __name__ == "__main__":
+    print("Can't run this file directly")
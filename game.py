@@ -1,17 +1,24 @@
 from flask_socketio import SocketIO, emit
-from flask import Flask, render_template, url_for, copy_current_request_context
+from flask import Flask, render_template, url_for, copy_current_request_context, request
 from random import random
-from time import sleep
-from threading import Thread, Event
+from threading import Thread, Event, Condition, Lock
+from functools import lru_cache
+import itertools
 import chess
 import chess.svg
-from agentminimax import AgentMinimax
-from agentuct import AgentUCT
+from enginepool import EnginePool, PooledAgent, valid_options
 from player import Player
 
 
-player_one = Player(False, AgentMinimax(2))
-player_two = Player(False, AgentUCT(10, 10))
+# The players of a new session. A client can change them with the configure message, eg.
+#   {'white': {'type': 'human'}, 'black': {'type': 'minimax', 'depth': 3}}
+default_config = {
+    'white': {'type': 'minimax', 'depth': 2},
+    'black': {'type': 'uct', 't_max': 10, 'min_tries_per_node': 10}}
+# Let the agent search while the human thinks. The process in the engine pool stops as soon
+#   as another game needs it
+pondering = True
+max_sessions = 100
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret_key'
@@ -19,7 +26,14 @@ app.config['SECRET_KEY'] = 'secret_key'
 
 socketio = SocketIO(app)
 
-thread = Thread()
+# One game per client, by Socket.IO session id. Every client is in a room of its own,
+#   named by the session id
+sessions = {}
+configs = {}
+sessions_lock = Lock()
+engine_pool = EnginePool()
+# Every game gets its own id, so clients can tell a restarted game from a missed ply
+game_ids = itertools.count(1)
 
 
 def scale_svg(svg_data, width_px=800):
@@ -28,15 +42,56 @@ def scale_svg(svg_data, width_px=800):
     return svg
 
 
-def send_message(msg):
-    socketio.emit('newmsg', {'msg': msg}, namespace='/chessgame')
+@lru_cache(maxsize=4096)
+def position_svg(board_fen):
+    # The picture only depends on the piece placement, so positions that come back
+    #   (and the same opening in every game) are only rendered once
+    return scale_svg(chess.svg.board(board=chess.BaseBoard(board_fen)))
+
+
+def send_message(msg, room):
+    socketio.emit('newmsg', {'msg': msg}, namespace='/chessgame', room=room)
+
+
+def send_stats(agent, room):
+    # Telemetry of the search behind the last move
+    if agent.stats is not None:
+        socketio.emit('stats', agent.stats.to_dict(), namespace='/chessgame', room=room)
+
+
+def create_player(game_id, config):
+    if config['type'] == 'human':
+        return Player(True)
+    options = {key: value for key, value in config.items() if key != 'type'}
+    return Player(False, PooledAgent(engine_pool, game_id, config['type'], options))
+
+
+def valid_player(config):
+    if type(config) != dict:
+        return False
+    options = {key: value for key, value in config.items() if key != 'type'}
+    if config.get('type') == 'human':
+        return len(options) == 0
+    return valid_options(config.get('type'), options)
+
+
+def valid_config(config):
+    # The config comes from the client, so every option is checked before an agent is made
+    return type(config) == dict and all(valid_player(config.get(color)) for color in ('white', 'black'))
 
 
 class GameThread(Thread):
-    def __init__(self):
-        super(GameThread, self).__init__()
-        self.svgs = []
+    def __init__(self, session_id, config):
+        super(GameThread, self).__init__(daemon=True)
+        self.session_id = session_id
+        self.game_id = next(game_ids)
+        self.player_one = create_player(self.game_id, config['white'])
+        self.player_two = create_player(self.game_id, config['black'])
+        # One entry per position since the start of the game, see ply_message
+        self.history = []
         self.input_move = None
+        # Notified when a human move is registered or the game is stopped
+        self.input_condition = Condition()
         self.board = chess.Board()
         self.__thread_stop_event__ = Event()
 
@@ -45,7 +100,9 @@ class GameThread(Thread):
                        for idx, move in enumerate(self.board.legal_moves)]
         print(legal_moves)
         if move_string in legal_moves:
-            self.input_move = move_string
+            with self.input_condition:
+                self.input_move = move_string
+                self.input_condition.notify_all()
         else:
             print("INVALID MOVE")
 
@@ -54,42 +111,80 @@ class GameThread(Thread):
         self.input_move = None
         return move
 
+    def wait_for_human_move(self, is_white):
+        # The opponent ponders while we wait. Returns None if the game is stopped
+        opponent = self.player_two if is_white else self.player_one
+        if pondering and not opponent.is_human:
+            # Stopped by the next move request or the release of the game
+            opponent.agent.ponder(self.board, not is_white)
+        with self.input_condition:
+            self.input_condition.wait_for(
+                lambda: self.input_move is not None or self.__thread_stop_event__.isSet())
+        if self.input_move is None:
+            return None
+        return self.get_human_move()
+
     def move(self, is_white):
-        if ((is_white == True) and (player_one.is_human)) or ((is_white == False) and (player_two.is_human)):
-            while self.input_move == None:
-                sleep(1)  # Sleep for a second and check again
-            chosen_move = self.get_human_move()
+        if ((is_white == True) and (self.player_one.is_human)) or ((is_white == False) and (self.player_two.is_human)):
+            chosen_move = self.wait_for_human_move(is_white)
+            if chosen_move is None:
+                return False
         else:
-            if is_white:
-                chosen_move = player_one.agent.make_move(self.board, True)
-            else:
-                chosen_move = player_two.agent.make_move(self.board, False)
+            agent = self.player_one.agent if is_white else self.player_two.agent
+            chosen_move = agent.make_move(self.board, is_white)
+            if not self.__thread_stop_event__.isSet():
+                # Unless a new game has taken over the room during the search
+                send_stats(agent, self.session_id)
             if chosen_move == None:
                 print("NO MORE MOVES!")
                 print(self.board.legal_moves)
         self.board.push(chosen_move)
-
-    def board_to_svg(self):
-        svg = chess.svg.board(board=self.board)
-        return scale_svg(svg)
-
-    def emit(self):
-        socketio.emit('newsvg', {'svgs': self.svgs}, namespace='/chessgame')
+        return True
+
+    def ply_message(self):
+        # The current position. seq is the number of plies played, so the client can
+        #   detect a missed message
+        move = self.board.peek().uci() if self.board.move_stack else None
+        return {'game': self.game_id,
+                'seq': len(self.board.move_stack),
+                'move': move,
+                'fen': self.board.fen(),
+                'svg': position_svg(self.board.board_fen())}
+
+    def add_ply(self):
+        # Only the new position is sent to the clients
+        if self.__thread_stop_event__.isSet():
+            # A new game has taken over the room
+            return
+        message = self.ply_message()
+        self.history.append(message)
+        socketio.emit('ply', message, namespace='/chessgame', room=self.session_id)
+
+    def emit_history(self):
+        # The whole game, for a client that just connected or lost track
+        message = {'game': self.game_id, 'plies': list(self.history)}
+        socketio.emit('history', message, namespace='/chessgame', room=self.session_id)
 
     def run(self):
-        svg = self.board_to_svg()
-        self.svgs.append(svg)
-        self.emit()
+        try:
+            self.play()
+        finally:
+            # The agents of the game aren't needed in the engine pool any more
+            engine_pool.release(self.game_id)
+
+    def play(self):
+        self.history.append(self.ply_message())
+        self.emit_history()
         while not self.__thread_stop_event__.isSet():
-            self.move(True)
-            self.svgs.append(self.board_to_svg())
-            self.emit()
+            if not self.move(True):
+                break
+            self.add_ply()
             if self.board.is_game_over():
                 self.game_over()
                 break
-            self.move(False)
-            self.svgs.append(self.board_to_svg())
-            self.emit()
+            if not self.move(False):
+                break
+            self.add_ply()
             if self.board.is_game_over():
                 self.game_over()
                 break
@@ -97,10 +192,12 @@ class GameThread(Thread):
 
     def game_over(self):
         print("GAME OVER")
-        send_message('gameover')
+        send_message('gameover', self.session_id)
 
     def do_stop(self):
-        self.__thread_stop_event__.set()
+        with self.input_condition:
+            self.__thread_stop_event__.set()
+            self.input_condition.notify_all()
 
 
 @app.route('/')
@@ -109,40 +206,73 @@ def index():
     return render_template('index.html')
 
 
-def start_game():
-    global thread
-    print("Starting Game")
-    # Stop running thread if it's initiated already
-    if type(thread) == GameThread:
-        thread.do_stop()
-    thread = GameThread()
+def start_game(session_id):
+    print("Starting Game for {}".format(session_id))
+    with sessions_lock:
+        # Stop the running game of the session if there is one
+        if session_id in sessions:
+            sessions[session_id].do_stop()
+        elif len(sessions) >= max_sessions:
+            send_message('The server is full, try again later', session_id)
+            return
+        thread = GameThread(session_id, configs.get(session_id, default_config))
+        sessions[session_id] = thread
     thread.start()
 
 
+def stop_game(session_id):
+    with sessions_lock:
+        thread = sessions.pop(session_id, None)
+        configs.pop(session_id, None)
+    if thread is not None:
+        thread.do_stop()
+
+
+def get_game(session_id):
+    with sessions_lock:
+        return sessions.get(session_id)
+
+
 @socketio.on('connect', namespace='/chessgame')
 def connect():
-    global thread
-    send_message('connected')
-    if not thread.is_alive():
-        start_game()
-    else:
-        thread.emit()
+    send_message('connected', request.sid)
+    start_game(request.sid)
 
 
 @socketio.on('disconnect', namespace='/chessgame')
 def disconnect():
     print('Client disconnected')
+    stop_game(request.sid)
 
 
 @socketio.on('human_move', namespace='/chessgame')
 def human_move(json):
-    global thread
-    thread.register_human_move(json['data'])
+    thread = get_game(request.sid)
+    if thread is not None:
+        thread.register_human_move(json['data'])
+
+
+@socketio.on('resync', namespace='/chessgame')
+def resync():
+    thread = get_game(request.sid)
+    if thread is not None:
+        thread.emit_history()
+
+
+@socketio.on('configure', namespace='/chessgame')
+def configure(json):
+    # New players for the session. Takes effect in a new game
+    if not valid_config(json):
+        send_message('Invalid configuration', request.sid)
+        return
+    with sessions_lock:
+        configs[request.sid] = json
+    start_game(request.sid)
 
 
 @socketio.on('restart', namespace='/chessgame')
 def restart():
-    start_game()
+    start_game(request.sid)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,167 @@
+# Struct-of-arrays storage for the MCTS tree. Nodes are integers indexing into preallocated
+#   arrays instead of Python objects, so a node takes a couple of dozen bytes and there's
+#   nothing for the garbage collector to track
+from array import array
+from collections import deque
+from multiprocessing.sharedctypes import RawArray
+import chess
+
+NO_NODE = -1
+
+
+def encode_move(move: chess.Move):
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code):
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
+
+
+def allocate(typecode, value, size, shared):
+    # Buffer of the given size filled with value. Shared buffers live in shared memory, so
+    #   processes started after the allocation see the same tree
+    if shared:
+        buf = RawArray(typecode, size)
+        if value:
+            buf[:] = [value] * size
+        return buf
+    return array(typecode, [value]) * size
+
+
+def fill(buf, value, size):
+    # Set the first size elements of the buffer to value
+    if isinstance(buf, array):
+        buf[:size] = array(buf.typecode, [value]) * size
+    else:
+        buf[:size] = [value] * size
+
+
+class NodeStore:
+    """ Node 0 is the root. The children of a node are stored next to each other, from
+    first_child[node] to first_child[node]+num_children[node]-1. A node that hasn't been
+    expanded has first_child == NO_NODE. Values are from the point of view of the player that
+    made the move to the node
+
+    With shared=True the buffers are allocated in shared memory, so the same tree can be
+    searched by several processes
+    """
+
+    def __init__(self, max_nodes=1000000, shared=False):
+        self.max_nodes = max_nodes
+        self.visits = allocate('i', 0, max_nodes, shared)
+        self.values = allocate('d', 0., max_nodes, shared)
+        self.parent = allocate('i', NO_NODE, max_nodes, shared)
+        self.first_child = allocate('i', NO_NODE, max_nodes, shared)
+        self.num_children = allocate('B', 0, max_nodes, shared)
+        self.moves = allocate('H', 0, max_nodes, shared)
+        self.size = allocate('i', 1, 1, shared)
+
+    @property
+    def num_nodes(self):
+        return self.size[0]
+
+    @num_nodes.setter
+    def num_nodes(self, value):
+        self.size[0] = value
+
+    def clear(self):
+        num_nodes = self.num_nodes
+        fill(self.visits, 0, num_nodes)
+        fill(self.values, 0., num_nodes)
+        fill(self.parent, NO_NODE, num_nodes)
+        fill(self.first_child, NO_NODE, num_nodes)
+        fill(self.num_children, 0, num_nodes)
+        fill(self.moves, 0, num_nodes)
+        self.num_nodes = 1
+
+    def is_expanded(self, node):
+        return self.first_child[node] != NO_NODE
+
+    def expand(self, node, moves):
+        # Add children for all the moves. Returns False if there's no room left in the store.
+        #   first_child is set last, so a reader that sees it set also sees the children
+        num_moves = len(moves)
+        first = self.num_nodes
+        if first + num_moves > self.max_nodes:
+            return False
+        self.num_nodes = first + num_moves
+        for idx, move in enumerate(moves, first):
+            self.parent[idx] = node
+            self.moves[idx] = encode_move(move)
+        self.num_children[node] = num_moves
+        self.first_child[node] = first
+        return True
+
+    def children(self, node):
+        first = self.first_child[node]
+        if first == NO_NODE:
+            return range(0)
+        return range(first, first + self.num_children[node])
+
+    def move(self, node):
+        return decode_move(self.moves[node])
+
+    def find_child(self, node, move: chess.Move):
+        code = encode_move(move)
+        for child in self.children(node):
+            if self.moves[child] == code:
+                return child
+        return NO_NODE
+
+    def root_move_stats(self, node=0):
+        # (move, visits, value) for every child that has been visited
+        return [(self.move(child), self.visits[child], self.values[child])
+                for child in self.children(node) if self.visits[child] > 0]
+
+    def principal_variation(self, node=0, max_length=20):
+        # Follow the most visited child
+        ret = []
+        while self.is_expanded(node) and len(ret) < max_length:
+            children = self.children(node)
+            if len(children) == 0:
+                break
+            node = max(children, key=lambda child: self.visits[child])
+            if self.visits[node] <= 0:
+                break
+            ret.append(self.move(node))
+        return ret
+
+    def extract_subtree(self, node):
+        # New store with the subtree of node as its tree, used to keep the statistics when
+        #   the root moves forward. Children blocks are copied breadth first
+        store = NodeStore(self.max_nodes)
+        store.visits[0] = self.visits[node]
+        store.values[0] = self.values[node]
+        queue = deque([(node, 0)])
+        while queue:
+            old, new = queue.popleft()
+            first = self.first_child[old]
+            if first == NO_NODE:
+                continue
+            num_children = self.num_children[old]
+            new_first = store.num_nodes
+            store.first_child[new] = new_first
+            store.num_children[new] = num_children
+            store.num_nodes += num_children
+            for offset in range(num_children):
+                store.parent[new_first+offset] = new
+                store.moves[new_first+offset] = self.moves[first+offset]
+                store.visits[new_first+offset] = self.visits[first+offset]
+                store.values[new_first+offset] = self.values[first+offset]
+                queue.append((first+offset, new_first+offset))
+        return store
+
+    def bytes_per_node(self):
+        return sum(memoryview(buf).itemsize for buf in (self.visits, self.values, self.parent,
+                                            self.first_child, self.num_children, self.moves))
+
+    def memory_usage(self):
+        return {
+            'num_nodes': self.num_nodes,
+            'max_nodes': self.max_nodes,
+            'bytes_allocated': self.max_nodes * self.bytes_per_node(),
+            'bytes_used': self.num_nodes * self.bytes_per_node()}
+
+
+if __name__ == "__main__":
+    print("Can't run this file directly")
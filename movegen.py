@@ -0,0 +1,446 @@
+# Compact move generation for the hot loops of the search. The board is a list of 64 piece
+#   codes that is changed in place by make/unmake, the moves are integers encoded as in
+#   mctstree.encode_move and the attacks come from tables computed once. Moves are generated
+#   pseudo-legal, and only the moves that are tried are checked for leaving the king in check
+#
+# Only standard chess, no Chess960 castling
+import random
+import chess
+import chess.polyglot
+from evaluation import square_values, zobrist_pieces, zobrist_turn
+
+EMPTY = -1
+# Piece codes are (piece type - 1) * 2 + color, the same as evaluation.feature_index, so the
+#   color of a piece is code & 1 and its type - 1 is code >> 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+promotions = (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT)
+# Castling rights as 4 bits, in the order of the Polyglot keys
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+MAX_PLY = 1024
+
+
+def targets(square, steps):
+    # Squares one step away in the given (file, rank) directions
+    file, rank = square & 7, square >> 3
+    return tuple((rank + dr) * 8 + file + df for df, dr in steps
+                 if 0 <= file + df < 8 and 0 <= rank + dr < 8)
+
+
+def rays(square, directions):
+    # For every direction, the squares from square to the edge of the board
+    ret = []
+    for df, dr in directions:
+        ray = []
+        file, rank = (square & 7) + df, (square >> 3) + dr
+        while 0 <= file < 8 and 0 <= rank < 8:
+            ray.append(rank * 8 + file)
+            file, rank = file + df, rank + dr
+        if ray:
+            ret.append(tuple(ray))
+    return tuple(ret)
+
+
+knight_steps = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+king_steps = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+knight_targets = [targets(square, knight_steps) for square in range(64)]
+king_targets = [targets(square, king_steps) for square in range(64)]
+# Squares attacked by a pawn of the color on the square, indexed by color
+pawn_captures = [[targets(square, [(-1, -1), (1, -1)]) for square in range(64)],
+                 [targets(square, [(-1, 1), (1, 1)]) for square in range(64)]]
+bishop_rays = [rays(square, [(1, 1), (-1, 1), (-1, -1), (1, -1)]) for square in range(64)]
+rook_rays = [rays(square, [(1, 0), (0, 1), (-1, 0), (0, -1)]) for square in range(64)]
+queen_rays = [bishop_rays[square] + rook_rays[square] for square in range(64)]
+# The same as moves from the square, so the target square of a move is move >> 6
+knight_moves = [tuple(square | target << 6 for target in knight_targets[square]) for square in range(64)]
+king_moves = [tuple(square | target << 6 for target in king_targets[square]) for square in range(64)]
+bishop_move_rays, rook_move_rays, queen_move_rays = (
+    [tuple(tuple(square | target << 6 for target in ray) for ray in square_rays[square])
+     for square in range(64)] for square_rays in (bishop_rays, rook_rays, queen_rays))
+
+# The castling rights that are kept when a piece moves from or to the square
+castling_masks = [15] * 64
+castling_masks[chess.E1] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+castling_masks[chess.H1] = 15 & ~WHITE_KINGSIDE
+castling_masks[chess.A1] = 15 & ~WHITE_QUEENSIDE
+castling_masks[chess.E8] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+castling_masks[chess.H8] = 15 & ~BLACK_KINGSIDE
+castling_masks[chess.A8] = 15 & ~BLACK_QUEENSIDE
+castling_keys = [0] * 16
+for rights in range(16):
+    for bit in range(4):
+        if rights & (1 << bit):
+            castling_keys[rights] ^= chess.polyglot.POLYGLOT_RANDOM_ARRAY[768 + bit]
+ep_keys = chess.polyglot.POLYGLOT_RANDOM_ARRAY[772:780]
+# Rook squares that give the castling rights, as in chess.Board.castling_rights
+castling_rooks = [(chess.H1, WHITE_KINGSIDE), (chess.A1, WHITE_QUEENSIDE),
+                  (chess.H8, BLACK_KINGSIDE), (chess.A8, BLACK_QUEENSIDE)]
+
+
+class FastBoard:
+    """ Board for make/unmake in the search. Keeps the static evaluation (score, for white) and
+    the Polyglot Zobrist key (key) up to date like evaluation.IncrementalEvaluator. The state
+    needed to unmake a move is kept in lists allocated once, indexed by the ply, so making and
+    unmaking moves allocates nothing. Repetitions aren't tracked
+    """
+
+    def __init__(self, board: chess.Board = None):
+        self.squares = [EMPTY] * 64
+        self.king_squares = [0, 0]
+        self.turn = 1
+        self.castling = 0
+        self.ep_square = -1
+        self.halfmove_clock = 0
+        self.ply = 0
+        self.score = 0
+        self.key = 0
+        self.undo_moves = [0] * MAX_PLY
+        self.undo_captured = [EMPTY] * MAX_PLY
+        self.undo_castling = [0] * MAX_PLY
+        self.undo_ep_square = [-1] * MAX_PLY
+        self.undo_halfmove_clock = [0] * MAX_PLY
+        self.undo_score = [0] * MAX_PLY
+        self.undo_key = [0] * MAX_PLY
+        if board is not None:
+            self.set_board(board)
+
+    def set_board(self, board: chess.Board):
+        # Take the position of a chess.Board. The moves before it aren't kept
+        squares = self.squares
+        for square in range(64):
+            squares[square] = EMPTY
+        key = 0
+        score = 0
+        for piece_type in chess.PIECE_TYPES:
+            for color in chess.COLORS:
+                code = (piece_type - 1) * 2 + color
+                for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                    squares[square] = code
+                    key ^= zobrist_pieces[code * 64 + square]
+                    score += square_values[code * 64 + square]
+        for color in chess.COLORS:
+            self.king_squares[color] = board.king(color) or 0
+        self.turn = int(board.turn)
+        self.castling = 0
+        for square, right in castling_rooks:
+            if board.castling_rights & chess.BB_SQUARES[square]:
+                self.castling |= right
+        self.ep_square = -1 if board.ep_square is None else board.ep_square
+        self.halfmove_clock = board.halfmove_clock
+        self.ply = 0
+        self.score = score
+        self.key = key ^ castling_keys[self.castling] ^ self.ep_key() ^ (zobrist_turn if self.turn else 0)
+
+    def to_board(self):
+        board = chess.Board(None)
+        for square, code in enumerate(self.squares):
+            if code != EMPTY:
+                board.set_piece_at(square, chess.Piece((code >> 1) + 1, bool(code & 1)))
+        board.turn = bool(self.turn)
+        for square, right in castling_rooks:
+            if self.castling & right:
+                board.castling_rights |= chess.BB_SQUARES[square]
+        board.ep_square = None if self.ep_square < 0 else self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+        return board
+
+    def ep_key(self):
+        # Polyglot only hashes the en passant square when a pawn of the side to move is next to
+        #   the pawn that can be taken
+        ep_square = self.ep_square
+        if ep_square < 0:
+            return 0
+        pawn = PAWN * 2 + self.turn
+        for square in pawn_captures[1 - self.turn][ep_square]:
+            if self.squares[square] == pawn:
+                return ep_keys[ep_square & 7]
+        return 0
+
+    def is_attacked(self, square, color):
+        # True when a piece of the color attacks the square
+        squares = self.squares
+        knight = KNIGHT * 2 + color
+        for target in knight_targets[square]:
+            if squares[target] == knight:
+                return True
+        pawn = PAWN * 2 + color
+        for target in pawn_captures[1 - color][square]:
+            if squares[target] == pawn:
+                return True
+        bishop, rook, queen = BISHOP * 2 + color, ROOK * 2 + color, QUEEN * 2 + color
+        for ray in bishop_rays[square]:
+            for target in ray:
+                piece = squares[target]
+                if piece != EMPTY:
+                    if piece == bishop or piece == queen:
+                        return True
+                    break
+        for ray in rook_rays[square]:
+            for target in ray:
+                piece = squares[target]
+                if piece != EMPTY:
+                    if piece == rook or piece == queen:
+                        return True
+                    break
+        king = KING * 2 + color
+        for target in king_targets[square]:
+            if squares[target] == king:
+                return True
+        return False
+
+    def is_check(self):
+        return self.is_attacked(self.king_squares[self.turn], 1 - self.turn)
+
+    def pseudo_legal_moves(self):
+        # Moves that follow the rules for how the pieces move, but may leave the king in check.
+        #   Castling is only generated when the king and the square it passes aren't attacked
+        squares = self.squares
+        color = self.turn
+        moves = []
+        append = moves.append
+        for square, piece in enumerate(squares):
+            if piece == EMPTY or piece & 1 != color:
+                continue
+            piece_type = piece >> 1
+            if piece_type == PAWN:
+                forward = 8 if color else -8
+                target = square + forward
+                promoting = (target >> 3) == (7 if color else 0)
+                if squares[target] == EMPTY:
+                    if promoting:
+                        for promotion in promotions:
+                            append(square | target << 6 | promotion << 12)
+                    else:
+                        append(square | target << 6)
+                        if (square >> 3) == (1 if color else 6) and squares[target + forward] == EMPTY:
+                            append(square | (target + forward) << 6)
+                for target in pawn_captures[color][square]:
+                    other = squares[target]
+                    if (other != EMPTY and other & 1 != color) or target == self.ep_square:
+                        if promoting:
+                            for promotion in promotions:
+                                append(square | target << 6 | promotion << 12)
+                        else:
+                            append(square | target << 6)
+            elif piece_type == KNIGHT or piece_type == KING:
+                for move in (knight_moves if piece_type == KNIGHT else king_moves)[square]:
+                    other = squares[move >> 6]
+                    if other == EMPTY or other & 1 != color:
+                        append(move)
+            else:
+                for ray in (bishop_move_rays if piece_type == BISHOP else
+                            rook_move_rays if piece_type == ROOK else queen_move_rays)[square]:
+                    for move in ray:
+                        other = squares[move >> 6]
+                        if other == EMPTY:
+                            append(move)
+                        else:
+                            if other & 1 != color:
+                                append(move)
+                            break
+        if self.castling:
+            self.castling_moves(moves)
+        return moves
+
+    def castling_moves(self, moves):
+        squares = self.squares
+        color = self.turn
+        kingside, queenside, king = (WHITE_KINGSIDE, WHITE_QUEENSIDE, chess.E1) if color else \
+            (BLACK_KINGSIDE, BLACK_QUEENSIDE, chess.E8)
+        if not self.castling & (kingside | queenside) or self.is_attacked(king, 1 - color):
+            return
+        if (self.castling & kingside and squares[king + 1] == EMPTY and squares[king + 2] == EMPTY
+                and not self.is_attacked(king + 1, 1 - color)):
+            moves.append(king | (king + 2) << 6)
+        if (self.castling & queenside and squares[king - 1] == EMPTY and squares[king - 2] == EMPTY
+                and squares[king - 3] == EMPTY and not self.is_attacked(king - 1, 1 - color)):
+            moves.append(king | (king - 2) << 6)
+
+    def make(self, move):
+        # Play a pseudo-legal move. The king of the side that moved may be left in check, see
+        #   make_legal
+        ply = self.ply
+        squares = self.squares
+        color = self.turn
+        from_square, to_square, promotion = move & 63, (move >> 6) & 63, move >> 12
+        piece = squares[from_square]
+        captured = squares[to_square]
+        self.undo_moves[ply] = move
+        self.undo_captured[ply] = captured
+        self.undo_castling[ply] = self.castling
+        self.undo_ep_square[ply] = self.ep_square
+        self.undo_halfmove_clock[ply] = self.halfmove_clock
+        self.undo_score[ply] = self.score
+        self.undo_key[ply] = self.key
+
+        key = self.key ^ self.ep_key()
+        score = self.score
+        idx = piece * 64 + from_square
+        key ^= zobrist_pieces[idx]
+        score -= square_values[idx]
+        if captured != EMPTY:
+            idx = captured * 64 + to_square
+            key ^= zobrist_pieces[idx]
+            score -= square_values[idx]
+        moved = piece if not promotion else (promotion - 1) * 2 + color
+        idx = moved * 64 + to_square
+        key ^= zobrist_pieces[idx]
+        score += square_values[idx]
+        squares[from_square] = EMPTY
+        squares[to_square] = moved
+
+        ep_square = -1
+        piece_type = piece >> 1
+        if piece_type == PAWN:
+            self.halfmove_clock = 0
+            if to_square == self.ep_square:
+                # En passant: the pawn that is taken is behind the square moved to
+                capture_square = to_square - 8 if color else to_square + 8
+                idx = squares[capture_square] * 64 + capture_square
+                key ^= zobrist_pieces[idx]
+                score -= square_values[idx]
+                squares[capture_square] = EMPTY
+            elif to_square - from_square == 16 or from_square - to_square == 16:
+                ep_square = (from_square + to_square) >> 1
+        else:
+            self.halfmove_clock = 0 if captured != EMPTY else self.halfmove_clock + 1
+            if piece_type == KING:
+                self.king_squares[color] = to_square
+                if to_square - from_square == 2 or from_square - to_square == 2:
+                    rook_from, rook_to = (from_square + 3, from_square + 1) if to_square > from_square \
+                        else (from_square - 4, from_square - 1)
+                    rook = squares[rook_from]
+                    key ^= zobrist_pieces[rook * 64 + rook_from] ^ zobrist_pieces[rook * 64 + rook_to]
+                    score += square_values[rook * 64 + rook_to] - square_values[rook * 64 + rook_from]
+                    squares[rook_from] = EMPTY
+                    squares[rook_to] = rook
+        castling = self.castling & castling_masks[from_square] & castling_masks[to_square]
+        if castling != self.castling:
+            key ^= castling_keys[self.castling] ^ castling_keys[castling]
+            self.castling = castling
+        self.ep_square = ep_square
+        self.turn = 1 - color
+        self.ply = ply + 1
+        self.score = score
+        self.key = key ^ zobrist_turn ^ self.ep_key()
+
+    def unmake(self):
+        self.ply -= 1
+        ply = self.ply
+        squares = self.squares
+        color = 1 - self.turn
+        move = self.undo_moves[ply]
+        from_square, to_square = move & 63, (move >> 6) & 63
+        piece = squares[to_square] if not move >> 12 else PAWN * 2 + color
+        squares[from_square] = piece
+        squares[to_square] = self.undo_captured[ply]
+        ep_square = self.undo_ep_square[ply]
+        piece_type = piece >> 1
+        if piece_type == PAWN and to_square == ep_square:
+            squares[to_square - 8 if color else to_square + 8] = PAWN * 2 + 1 - color
+        elif piece_type == KING:
+            self.king_squares[color] = from_square
+            if to_square - from_square == 2 or from_square - to_square == 2:
+                rook_from, rook_to = (from_square + 3, from_square + 1) if to_square > from_square \
+                    else (from_square - 4, from_square - 1)
+                squares[rook_from] = squares[rook_to]
+                squares[rook_to] = EMPTY
+        self.turn = color
+        self.castling = self.undo_castling[ply]
+        self.ep_square = ep_square
+        self.halfmove_clock = self.undo_halfmove_clock[ply]
+        self.score = self.undo_score[ply]
+        self.key = self.undo_key[ply]
+
+    def make_legal(self, move):
+        # Play the move if it doesn't leave the own king in check. Returns False, with the
+        #   board unchanged, if it does
+        self.make(move)
+        if self.is_attacked(self.king_squares[1 - self.turn], self.turn):
+            self.unmake()
+            return False
+        return True
+
+    def pinned(self):
+        # Bitmask of the pieces of the side to move that can't leave the line to their king
+        squares = self.squares
+        color = self.turn
+        queen = QUEEN * 2 + 1 - color
+        ret = 0
+        for slider, king_rays in ((BISHOP * 2 + 1 - color, bishop_rays), (ROOK * 2 + 1 - color, rook_rays)):
+            for ray in king_rays[self.king_squares[color]]:
+                own = -1
+                for target in ray:
+                    piece = squares[target]
+                    if piece == EMPTY:
+                        continue
+                    if piece & 1 == color:
+                        if own >= 0:
+                            break
+                        own = target
+                    else:
+                        if own >= 0 and (piece == slider or piece == queen):
+                            ret |= 1 << own
+                        break
+        return ret
+
+    def legal_moves(self):
+        # Out of check, only the moves of the king, of pinned pieces and en passant captures
+        #   can leave the king in check, so only those are made to check them
+        moves = self.pseudo_legal_moves()
+        if self.is_check():
+            pinned, king = -1, -1
+        else:
+            pinned, king = self.pinned(), self.king_squares[self.turn]
+        ep_square = self.ep_square
+        squares = self.squares
+        ret = []
+        for move in moves:
+            from_square = move & 63
+            if (pinned >= 0 and from_square != king and not pinned >> from_square & 1 and
+                    ((move >> 6) & 63 != ep_square or squares[from_square] >> 1 != PAWN)):
+                ret.append(move)
+            elif self.make_legal(move):
+                self.unmake()
+                ret.append(move)
+        return ret
+
+    def make_random_move(self, rng=random):
+        # Play a random legal move and return it, or None when there is none. Pseudo-legal
+        #   moves are tried at random, so only the tried moves are checked
+        moves = self.pseudo_legal_moves()
+        while moves:
+            idx = rng.randrange(len(moves))
+            move = moves[idx]
+            if self.make_legal(move):
+                return move
+            moves[idx] = moves[-1]
+            moves.pop()
+        return None
+
+    def is_insufficient_material(self):
+        # Only kings and at most one knight or bishop left
+        minors = 0
+        for piece in self.squares:
+            if piece != EMPTY:
+                piece_type = piece >> 1
+                if piece_type == KNIGHT or piece_type == BISHOP:
+                    minors += 1
+                elif piece_type != KING:
+                    return False
+        return minors <= 1
+
+    def perft(self, depth):
+        # Number of legal move sequences of the given length, see benchmark.perft
+        moves = self.legal_moves()
+        if depth == 1:
+            return len(moves)
+        ret = 0
+        for move in moves:
+            self.make(move)
+            ret += self.perft(depth - 1)
+            self.unmake()
+        return ret
+
+
+if __name__ == "__main__":
+    print("Can't run this file directly")
@@ -0,0 +1,92 @@
+# Move ordering for the alpha-beta search, see https://www.chessprogramming.org/Move_Ordering
+# Moves are generated in stages, so the quiet moves don't have to be generated at all
+#   when one of the first moves causes a cutoff
+import chess
+from evaluation import piece_values
+
+MAX_PLY = 128
+BB_BACKRANKS = chess.BB_RANK_1 | chess.BB_RANK_8
+
+
+class MoveOrderer:
+    """ Orders the moves as: hash move, captures and queen promotions (MVV-LVA), killer moves
+    and finally the remaining quiet moves sorted by their history score. Killers and history
+    are updated from cutoffs in the search and are kept during the search
+    """
+
+    def __init__(self):
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [[0] * (64 * 64) for _ in chess.COLORS]
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def new_search(self):
+        # Killers are only valid for the position they were found in, while the history
+        #   is kept with less weight
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        for history in self.history:
+            for idx in range(len(history)):
+                history[idx] >>= 1
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def mvv_lva(self, board: chess.Board, move: chess.Move):
+        # Most valuable victim first, and for the same victim the least valuable attacker
+        victim = board.piece_type_at(move.to_square) or chess.PAWN
+        attacker = board.piece_type_at(move.from_square)
+        ret = piece_values[victim] * 10 - attacker
+        if move.promotion:
+            ret += piece_values[move.promotion] * 10
+        return ret
+
+    def ordered_moves(self, board: chess.Board, ply, hash_move=None):
+        # Generator, so the caller can stop as soon as a move causes a cutoff
+        tried = []
+        if hash_move is not None and board.is_legal(hash_move):
+            tried.append(hash_move)
+            yield hash_move
+
+        captures = list(board.generate_legal_captures())
+        # Quiet queen promotions go together with the captures
+        captures.extend(move for move in board.generate_legal_moves(
+            board.pawns, BB_BACKRANKS & ~board.occupied)
+            if move.promotion == chess.QUEEN)
+        captures.sort(key=lambda move: self.mvv_lva(board, move), reverse=True)
+        for move in captures:
+            if move != hash_move:
+                tried.append(move)
+                yield move
+
+        killers = self.killers[ply] if ply < MAX_PLY else []
+        for move in killers:
+            if move is not None and move not in tried and board.is_legal(move) \
+                    and not board.is_capture(move):
+                tried.append(move)
+                yield move
+
+        history = self.history[board.turn]
+        quiets = [move for move in board.generate_legal_moves(
+            chess.BB_ALL, ~board.occupied_co[not board.turn])
+            if move not in tried and not board.is_en_passant(move)]
+        quiets.sort(key=lambda move: history[move.from_square*64+move.to_square], reverse=True)
+        for move in quiets:
+            yield move
+
+    def record_cutoff(self, board: chess.Board, move: chess.Move, ply, depth, move_number):
+        # Called with the position before the move was made
+        self.cutoffs += 1
+        if move_number == 0:
+            self.first_move_cutoffs += 1
+        if board.is_capture(move) or move.promotion == chess.QUEEN:
+            return
+        if ply < MAX_PLY and self.killers[ply][0] != move:
+            self.killers[ply][1] = self.killers[ply][0]
+            self.killers[ply][0] = move
+        self.history[board.turn][move.from_square*64+move.to_square] += depth * depth
+
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs > 0 else 0.
+
+
+if __name__ == "__main__":
+    print("Can't run this file directly")
@@ -0,0 +1,117 @@
+# Opening book in the Polyglot format, and a command to build one from PGN files
+#
+#   $ python openingbook.py --output book.bin games1.pgn games2.pgn
+#
+# The book is memory mapped and the entries are found by binary search on the Zobrist key of
+#   the position, so opening it is instant and only the pages that are looked at are read
+import argparse
+import random
+import chess
+import chess.pgn
+import chess.polyglot
+
+# Points for the side that played the move
+result_points = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1)}
+
+
+class OpeningBook:
+    """ Moves for known positions from a Polyglot book. With weighted set, the move is picked
+    at random in proportion to the weights of the book, otherwise the move with the highest
+    weight is played. The book isn't used after max_ply plies
+    """
+
+    def __init__(self, path, max_ply=None, weighted=True):
+        self.path = path
+        self.max_ply = max_ply
+        self.weighted = weighted
+        self.reader = chess.polyglot.open_reader(path)
+
+    def __getstate__(self):
+        # The memory map can't be sent to other processes, so it's opened again
+        state = self.__dict__.copy()
+        del state['reader']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reader = chess.polyglot.open_reader(self.path)
+
+    def get_move(self, board: chess.Board):
+        # Returns None when the position isn't in the book
+        ply = 2 * (board.fullmove_number - 1) + (0 if board.turn == chess.WHITE else 1)
+        if self.max_ply is not None and ply >= self.max_ply:
+            return None
+        try:
+            if self.weighted:
+                return self.reader.weighted_choice(board, random=random).move()
+            return self.reader.find(board).move()
+        except IndexError:
+            return None
+
+    def close(self):
+        self.reader.close()
+
+
+def raw_move(board: chess.Board, move: chess.Move):
+    # Polyglot encodes castling as the king taking its own rook
+    to_square = move.to_square
+    if board.is_kingside_castling(move):
+        to_square = chess.square(7, chess.square_rank(move.from_square))
+    elif board.is_queenside_castling(move):
+        to_square = chess.square(0, chess.square_rank(move.from_square))
+    promotion = move.promotion - 1 if move.promotion else 0
+    return to_square | (move.from_square << 6) | (promotion << 12)
+
+
+def build_book(pgn_paths, output, max_ply=30, min_games=1):
+    # Every move played in the first max_ply plies gets 2 points for a win and 1 for a draw, for
+    #   the side that played it. Moves played in fewer than min_games games are left out
+    moves = {}
+    num_games = 0
+    for path in pgn_paths:
+        with open(path) as f:
+            while True:
+                game = chess.pgn.read_game(f)
+                if game is None:
+                    break
+                points = result_points.get(game.headers.get('Result'))
+                if points is None:
+                    continue
+                board = game.board()
+                for ply, move in enumerate(game.mainline_moves()):
+                    if ply >= max_ply:
+                        break
+                    key = (chess.polyglot.zobrist_hash(board), raw_move(board, move))
+                    count, score = moves.get(key, (0, 0))
+                    moves[key] = (count + 1, score + points[0 if board.turn == chess.WHITE else 1])
+                    board.push(move)
+                num_games += 1
+                if num_games % 1000 == 0:
+                    print('{} games, {} moves'.format(num_games, len(moves)))
+    entries = [(key, move, score) for (key, move), (count, score) in moves.items()
+               if count >= min_games and score > 0]
+    # The weights are 16 bits
+    scale = max([score for _, _, score in entries], default=0) / 0xffff
+    # Sorted by key for the binary search, and the best move first in every position
+    entries.sort(key=lambda x: (x[0], -x[2]))
+    with open(output, 'wb') as f:
+        for key, move, score in entries:
+            weight = max(1, int(score / scale)) if scale > 1 else score
+            f.write(chess.polyglot.ENTRY_STRUCT.pack(key, move, weight, 0))
+    print('Wrote {} entries from {} games to {}'.format(len(entries), num_games, output))
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a Polyglot opening book from PGN files')
+    parser.add_argument('pgn', nargs='+', help='PGN files with the games')
+    parser.add_argument('--output', default='book.bin', help='Where to write the book')
+    parser.add_argument('--max-ply', type=int, default=30, help='Plies to include from every game')
+    parser.add_argument('--min-games', type=int, default=1,
+                        help='Leave out moves played in fewer games than this')
+    args = parser.parse_args()
+    build_book(args.pgn, args.output, args.max_ply, args.min_games)
+
+
+if __name__ == "__main__":
+    main()
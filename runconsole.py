@@ -8,41 +8,42 @@ player_one = Player(False, AgentMinimax(2))
 player_two = Player(False, AgentUCT(5, 10))
 
 
-def print_board(board, fname, no_plys):
+def print_board(board, f, no_plys):
     print(board)
     print('Number of plys: %d' % (no_plys))
     print()
-    print_to_file(board, fname, no_plys)
+    print_to_file(board, f, no_plys)
     if board.is_game_over():
         print("GAME OVER")
 
 
-def print_to_file(board, fname, no_plys):
-    f = open(fname, "a+")
+def print_to_file(board, f, no_plys):
     f.write(board.__str__())
     f.write('\nNumber of plys: %d\n\n' % (no_plys))
-    f.close()
-
-
-def run(board, is_white, fname, no_plys=0):
-    if is_white:
-        chosen_move = player_one.agent.make_move(board, True)
-    else:
-        chosen_move = player_two.agent.make_move(board, False)
-    if chosen_move == None:
-        return
-    board.push(chosen_move)
-    no_plys += 1
-    print_board(board, fname, no_plys)
-    if board.is_game_over():
-        print("GAME OVER")
-        return
-    else:
-        run(board, not is_white, fname, no_plys)
+
+
+def run(board, is_white, fname):
+    # Play the game to the end. The file is kept open for the whole game
+    no_plys = 0
+    with open(fname, "a+") as f:
+        while not board.is_game_over():
+            agent = player_one.agent if is_white else player_two.agent
+            chosen_move = agent.make_move(board, is_white)
+            if chosen_move == None:
+                return
+            if agent.stats is not None:
+                print(agent.stats.summary())
+            board.push(chosen_move)
+            no_plys += 1
+            print_board(board, f, no_plys)
+            is_white = not is_white
 
 
 if __name__ == "__main__":
-    board = chess.Board()
     no_games = 3
     for i in range(0, no_games):
-        run(board, True, 'rungame{}.txt'.format(i+1))
+        # Every game starts from the initial position
+        run(chess.Board(), True, 'rungame{}.txt'.format(i+1))
+    for player in (player_one, player_two):
+        if hasattr(player.agent, 'close'):
+            player.agent.close()
@@ -1,6 +1,7 @@
 let running = true;
 let show_id = 0;
 let svgs = [];
+let game = null;
 let socket = null;
 let possibleSquares = getPossibleSquares();
 
@@ -30,19 +31,65 @@ $(document).ready(function() {
   );
 
   //  Subscribe to messages from server
-  socket.on('newsvg', function(msg) {
-    svgs = msg.svgs;
-    if (running === true) {
-      update_show_id(svgs.length - 1 - show_id);
+  socket.on('history', function(msg) {
+    // The whole game, sent on connect and when asking for a resync
+    game = msg.game;
+    svgs = msg.plies.map(function(ply) {
+      return ply.svg;
+    });
+    show_id = Math.min(show_id, svgs.length - 1);
+    showLatest();
+  });
+
+  socket.on('ply', function(msg) {
+    // One new position. Ask for the whole game if one was missed or the game restarted
+    if (msg.game !== game || msg.seq > svgs.length) {
+      socket.emit('resync');
+      return;
     }
-    render();
+    if (msg.seq < svgs.length) {
+      return;
+    }
+    svgs.push(msg.svg);
+    showLatest();
   });
 
   socket.on('newmsg', function(msg) {
     handleMessage(msg);
   });
+
+  socket.on('stats', function(stats) {
+    renderStats(stats);
+  });
 });
 
+function renderStats(stats) {
+  let text =
+    stats.agent + ' played ' + stats.move +
+    ': ' + stats.nodes + ' nodes, depth ' + stats.depth +
+    ', ' + stats.time.toFixed(2) + 's, ' + Math.round(stats.nps) + ' nodes/s';
+  if (stats.simulations) {
+    text += ', ' + stats.simulations + ' simulations';
+  }
+  if (stats.cache_hit_rate !== null) {
+    text += ', cache hit rate ' + (100 * stats.cache_hit_rate).toFixed(1) + '%';
+  }
+  if (stats.pv.length > 0) {
+    text += ', pv ' + stats.pv.join(' ');
+  }
+  if (stats.workers.length > 0) {
+    text += ', ' + stats.workers.length + ' workers';
+  }
+  $('#stats').text(text);
+}
+
+function showLatest() {
+  if (running === true) {
+    update_show_id(svgs.length - 1 - show_id);
+  }
+  render();
+}
+
 function handleMessage(msg) {
   console.log(msg);
   switch (msg.msg) {
@@ -144,6 +191,15 @@ function restart_game() {
   socket.emit('restart');
 }
 
+function configure_game() {
+  // Start a new game with the chosen players
+  resetMessages();
+  socket.emit('configure', {
+    white: { type: $('#white-player').val() },
+    black: { type: $('#black-player').val() }
+  });
+}
+
 function update_show_id(diff) {
   const new_show_id = show_id + diff;
   $('#previous').prop('disabled', false);
@@ -0,0 +1,125 @@
+# Syzygy endgame tablebases. The tables are read from a local directory, eg. downloaded from
+#   https://syzygy-tables.info
+import os
+import chess
+import chess.polyglot
+import chess.syzygy
+
+# Score of a won position for AgentMinimax. Higher than any evaluation, but lower than a mate
+#   so a mate that is found is still preferred
+tablebase_win = 100000
+# Win, draw and loss for white -> result for white, as in agentuct.results. Cursed wins and
+#   blessed losses are draws because of the fifty-move rule
+white_results = {2: 1, 1: 0.5, 0: 0.5, -1: 0.5, -2: 0}
+
+
+class Tablebase:
+    """ Win/draw/loss and distance to zeroing probes, for positions with at most max_pieces
+    pieces. max_pieces defaults to the largest tables in the directory. The results of the WDL
+    probes are cached by the Zobrist key of the position
+    """
+
+    def __init__(self, directory, max_pieces=None, cache_size=100000):
+        self.directory = directory
+        self.max_pieces = max_pieces or largest_table(directory)
+        self.cache_size = cache_size
+        self.cache = {}
+        self.hits = 0
+        self.probes = 0
+        self.tablebase = chess.syzygy.open_tablebase(directory)
+
+    def __getstate__(self):
+        # The open files can't be sent to other processes, so the tables are opened again
+        state = self.__dict__.copy()
+        del state['tablebase']
+        state['cache'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tablebase = chess.syzygy.open_tablebase(self.directory)
+
+    def can_probe(self, board: chess.Board):
+        return chess.popcount(board.occupied) <= self.max_pieces and not board.castling_rights
+
+    def probe_wdl(self, board: chess.Board, key=None):
+        # 2 for a win for the side to move down to -2 for a loss, or None if the position
+        #   isn't in the tables. key is the Polyglot key of the position, if the caller has it
+        if not self.can_probe(board):
+            return None
+        if key is None:
+            key = chess.polyglot.zobrist_hash(board)
+        self.probes += 1
+        if key in self.cache:
+            self.hits += 1
+            return self.cache[key]
+        try:
+            wdl = self.tablebase.probe_wdl(board)
+        except KeyError:
+            wdl = None
+        if len(self.cache) >= self.cache_size:
+            # Drop the oldest half, dicts keep the insertion order
+            for old_key in list(self.cache)[:self.cache_size // 2]:
+                del self.cache[old_key]
+        self.cache[key] = wdl
+        return wdl
+
+    def result(self, board: chess.Board, key=None):
+        # Result for white, as in agentuct.results, or None
+        wdl = self.probe_wdl(board, key)
+        if wdl is None:
+            return None
+        return white_results[wdl if board.turn == chess.WHITE else -wdl]
+
+    def score(self, board: chess.Board, ply, key=None):
+        # Score for white for AgentMinimax, or None. Quicker wins are worth more
+        wdl = self.probe_wdl(board, key)
+        if wdl is None:
+            return None
+        score = 0 if abs(wdl) < 2 else (tablebase_win - ply) * wdl // 2
+        return score if board.turn == chess.WHITE else -score
+
+    def best_move(self, board: chess.Board):
+        # The move that keeps the best result, and reaches it the quickest: the lowest distance
+        #   to zeroing (DTZ) when winning, and the highest when losing. None if the position
+        #   isn't in the tables
+        if not self.can_probe(board):
+            return None
+        best, best_key = None, None
+        for move in board.legal_moves:
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            try:
+                wdl = -self.tablebase.probe_wdl(board)
+                dtz = -self.tablebase.probe_dtz(board)
+                checkmate = board.is_checkmate()
+            except KeyError:
+                return None
+            finally:
+                board.pop()
+            if wdl > 0:
+                # Mate right away, or reset the fifty-move counter, or get closer to it
+                distance = 0 if checkmate else 1 if zeroing else dtz
+                key = (wdl, -distance)
+            else:
+                key = (wdl, -dtz)
+            if best_key is None or key > best_key:
+                best, best_key = move, key
+        return best
+
+    def close(self):
+        self.tablebase.close()
+
+
+def largest_table(directory):
+    # The number of pieces of the largest WDL table, eg. 5 for KRPvKP.rtbw
+    ret = 0
+    for fname in os.listdir(directory):
+        name, ext = os.path.splitext(fname)
+        if ext == '.rtbw':
+            ret = max(ret, len(name) - 1)
+    return ret
+
+
+if __name__ == "__main__":
+    print("Can't run this file directly")
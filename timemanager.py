@@ -0,0 +1,74 @@
+# Splits the time on a game clock over the moves
+import time
+import chess
+
+
+class TimeManager:
+    """ Keeps the clock of one player and gives every move a soft and a hard budget in seconds.
+    The search should normally stop after the soft budget, and may go on to the hard budget
+    when the best move isn't clear. It must never go past the hard budget
+
+    The clock starts at base seconds and gets increment seconds after every move. With
+    moves_to_go, base is added again every moves_to_go moves (eg. 40 moves in 90 minutes).
+    Without it, the game is expected to last expected_moves moves
+    """
+
+    # Seconds to keep for the overhead of making the move and sending it
+    overhead = 0.05
+    expected_moves = 40
+    min_moves_left = 10
+
+    def __init__(self, base, increment=0, moves_to_go=None):
+        self.base = base
+        self.increment = increment
+        self.moves_to_go = moves_to_go
+        self.remaining = base
+        self.moves_left_in_period = moves_to_go
+        self.t_start = None
+        self.soft = None
+        self.hard = None
+
+    def start_move(self, board: chess.Board):
+        # Start the clock for a move in board. Returns the soft and the hard budget
+        self.t_start = time.time()
+        if self.moves_to_go:
+            moves_left = self.moves_left_in_period
+        else:
+            moves_left = max(self.min_moves_left, self.expected_moves - board.fullmove_number)
+        available = max(self.remaining - self.overhead, 0)
+        if board.legal_moves.count() <= 1:
+            # Nothing to think about
+            self.soft = self.hard = 0.
+        else:
+            self.soft = available / moves_left + 0.75 * self.increment
+            # Never more than a third of what is left, so an unclear position can't use it all
+            self.hard = min(4 * self.soft, available / 3 + self.increment, available)
+            self.soft = min(self.soft, self.hard)
+        return self.soft, self.hard
+
+    def elapsed(self):
+        return time.time() - self.t_start
+
+    def stop_move(self):
+        # Stop the clock after the move. Returns the time that was used
+        used = self.elapsed()
+        self.remaining += self.increment - used
+        if self.moves_to_go:
+            self.moves_left_in_period -= 1
+            if self.moves_left_in_period == 0:
+                self.remaining += self.base
+                self.moves_left_in_period = self.moves_to_go
+        self.t_start = None
+        return used
+
+    def set_remaining(self, remaining):
+        # Sync with an external clock, eg. the one of the server
+        self.remaining = remaining
+
+    def flagged(self):
+        # True when the clock has run out
+        return self.remaining < 0
+
+
+if __name__ == "__main__":
+    print("Can't run this file directly")
@@ -0,0 +1,296 @@
+# Headless match between two agents. Plays the games in parallel, one per process, writes them
+#   to a PGN file as they finish and reports the score, the Elo difference and an SPRT verdict.
+#
+#   $ python tournament.py --engine1 minimax:depth=3 --engine2 minimax:depth=2 --games 100
+#   $ python tournament.py --engine1 uct:t_max=1 --engine2 minimax:t_max=1 --openings openings.epd
+#   $ python tournament.py --engine1 uct:min_tries_per_node=5 --engine2 minimax --tc 60+0.5
+#
+# Every opening is played twice, with the colors swapped, so both engines get the same positions
+import argparse
+import math
+import multiprocessing as mp
+import os
+import time
+import chess
+import chess.pgn
+from enginepool import create_agent, agent_options
+from openingbook import OpeningBook
+from tablebase import Tablebase
+from timemanager import TimeManager
+
+# Used when no openings file is given. Balanced positions after a few moves of common openings
+default_openings = [
+    chess.STARTING_FEN,
+    'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/pppp1ppp/4p3/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkb1r/pppppppp/5n2/8/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 1 2',
+    'rnbqkbnr/pppppppp/8/8/2P5/8/PP1PPPPP/RNBQKBNR b KQkq - 0 1',
+    'rnbqkbnr/pp1ppppp/2p5/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2']
+
+
+def parse_engine(spec):
+    # 'minimax:depth=3,t_max=1' -> ('minimax', {'depth': 3, 't_max': 1.0})
+    agent_type, _, option_string = spec.partition(':')
+    if agent_type not in agent_options:
+        raise argparse.ArgumentTypeError('Unknown agent type {}'.format(agent_type))
+    options = {}
+    for option in filter(None, option_string.split(',')):
+        key, _, value = option.partition('=')
+        if key not in agent_options[agent_type]:
+            raise argparse.ArgumentTypeError('Unknown option {} for {}'.format(key, agent_type))
+        options[key] = float(value) if '.' in value else int(value)
+    return agent_type, options
+
+
+def parse_time_control(spec):
+    # '60+0.5' -> (60.0, 0.5, None), '40/300' -> (300.0, 0, 40), as the PGN TimeControl tag
+    moves_to_go, _, clock = spec.rpartition('/')
+    base, _, increment = clock.partition('+')
+    try:
+        return float(base), float(increment or 0), int(moves_to_go) if moves_to_go else None
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid time control {}'.format(spec))
+
+
+def read_openings(fname):
+    # One FEN or EPD per line. EPD operations after the position are ignored
+    openings = []
+    with open(fname) as f:
+        for line in f:
+            line = line.split(';')[0].strip()
+            if line and not line.startswith('#'):
+                board, _ = chess.Board.from_epd(line)
+                openings.append(board.fen())
+    return openings
+
+
+def play_game(task):
+    # Play one game in a worker process. Returns the game as a PGN string and the result
+    #   from the point of view of engine 1
+    (game_number, fen, engine1_is_white, engine1, engine2, max_plies, book_path, book_plies,
+     tablebase_path, time_control) = task
+    engines = [engine1, engine2] if engine1_is_white else [engine2, engine1]
+    agents = [create_agent(*engine) for engine in engines]
+    if book_path:
+        book = OpeningBook(book_path, book_plies)
+        for agent in agents:
+            agent.use_book(book)
+    if tablebase_path:
+        tablebase = Tablebase(tablebase_path)
+        for agent in agents:
+            agent.use_tablebase(tablebase)
+    if time_control:
+        for agent in agents:
+            agent.use_time_manager(TimeManager(*time_control))
+    board = chess.Board(fen)
+    move_times = []
+    termination = 'normal'
+    while not board.is_game_over(claim_draw=True):
+        if len(move_times) >= max_plies:
+            termination = 'adjudication'
+            break
+        agent = agents[0] if board.turn == chess.WHITE else agents[1]
+        t_start = time.time()
+        move = agent.make_move(board, board.turn)
+        move_times.append(time.time() - t_start)
+        if move is None or not board.is_legal(move):
+            termination = 'rules infraction'
+            break
+        if agent.time_manager is not None and agent.time_manager.flagged():
+            termination = 'time forfeit'
+            break
+        board.push(move)
+    for agent in agents:
+        if hasattr(agent, 'close'):
+            agent.close()
+
+    if termination == 'normal':
+        result = board.result(claim_draw=True)
+    elif termination == 'adjudication':
+        result = '1/2-1/2'
+    else:
+        # The side to move failed to make a legal move in time
+        result = '0-1' if board.turn == chess.WHITE else '1-0'
+    game = chess.pgn.Game.from_board(board)
+    game.headers['Event'] = 'Tournament'
+    game.headers['Round'] = str(game_number)
+    game.headers['White'] = format_engine(engines[0])
+    game.headers['Black'] = format_engine(engines[1])
+    game.headers['Result'] = result
+    game.headers['Termination'] = termination
+    if time_control:
+        game.headers['TimeControl'] = format_time_control(time_control)
+    node = game
+    for move_time in move_times:
+        node = node.variations[0]
+        node.comment = '[%emt {:.3f}]'.format(move_time)
+    score = {'1-0': 1., '0-1': 0., '1/2-1/2': .5}[result]
+    if not engine1_is_white:
+        score = 1 - score
+    return str(game), score, len(move_times), sum(move_times)
+
+
+def format_engine(engine):
+    agent_type, options = engine
+    return agent_type + ''.join(' {}={}'.format(key, value) for key, value in sorted(options.items()))
+
+
+def format_time_control(time_control):
+    base, increment, moves_to_go = time_control
+    ret = '{}/{:g}'.format(moves_to_go, base) if moves_to_go else '{:g}'.format(base)
+    return ret + ('+{:g}'.format(increment) if increment else '')
+
+
+def elo_difference(score):
+    # Elo difference for an expected score, from the logistic model
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+class MatchResult:
+    """ Wins, draws and losses of engine 1 """
+
+    def __init__(self):
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    def add(self, score):
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        return (self.wins + self.draws / 2) / self.games() if self.games() else .5
+
+    def variance(self, wins=None, draws=None, losses=None):
+        # Variance of the score of one game
+        wins, draws, losses = (self.wins, self.draws, self.losses) if wins is None else (wins, draws, losses)
+        games = wins + draws + losses
+        if games == 0:
+            return 0.
+        mean = (wins + draws / 2) / games
+        return (wins * (1 - mean) ** 2 + draws * (.5 - mean) ** 2 + losses * mean ** 2) / games
+
+    def elo(self):
+        # Elo difference with the 95% confidence interval
+        elo = elo_difference(self.score())
+        if self.games() == 0:
+            return elo, (-math.inf, math.inf)
+        margin = 1.96 * math.sqrt(self.variance() / self.games())
+        return elo, (elo_difference(self.score() - margin), elo_difference(self.score() + margin))
+
+    def llr(self, elo0, elo1):
+        # Log likelihood ratio of elo1 against elo0, with the normal approximation of the
+        #   trinomial model. Half a game is added to every outcome, so the variance isn't zero
+        #   after a few games with the same result
+        wins, draws, losses = self.wins + .5, self.draws + .5, self.losses + .5
+        games = wins + draws + losses
+        score = (wins + draws / 2) / games
+        score0, score1 = expected_score(elo0), expected_score(elo1)
+        return ((score1 - score0) * (2 * score - score0 - score1) * games /
+                (2 * self.variance(wins, draws, losses)))
+
+    def sprt(self, elo0, elo1, alpha, beta):
+        # 'H1' when engine 1 is at least elo1 stronger, 'H0' when it's at most elo0 stronger,
+        #   None when the games don't tell yet
+        llr = self.llr(elo0, elo1)
+        if llr >= math.log((1 - beta) / alpha):
+            return 'H1'
+        elif llr <= math.log(beta / (1 - alpha)):
+            return 'H0'
+        return None
+
+
+def get_num_processes():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return mp.cpu_count()
+
+
+def run_match(args):
+    openings = read_openings(args.openings) if args.openings else default_openings
+    tasks = []
+    for game_number in range(args.games):
+        # Both colors for each opening before going to the next
+        fen = openings[(game_number // 2) % len(openings)]
+        tasks.append((game_number + 1, fen, game_number % 2 == 0,
+                      args.engine1, args.engine2, args.max_plies, args.book, args.book_plies,
+                      args.tablebase, args.tc))
+    result = MatchResult()
+    verdict = None
+    t_start = time.time()
+    with mp.Pool(args.workers or get_num_processes()) as pool, open(args.output, 'w') as f:
+        for pgn, score, num_plies, move_time in pool.imap_unordered(play_game, tasks):
+            # The games are written as they finish, so an interrupted match keeps them
+            f.write(pgn + '\n\n')
+            f.flush()
+            result.add(score)
+            elo, _ = result.elo()
+            print('Game {}/{}: {} plies, {:.2f}s per move. +{} ={} -{}, Elo {:+.1f}, LLR {:.2f}'.format(
+                result.games(), args.games, num_plies, move_time / max(num_plies, 1),
+                result.wins, result.draws, result.losses, elo,
+                result.llr(args.elo0, args.elo1)))
+            verdict = result.sprt(args.elo0, args.elo1, args.alpha, args.beta)
+            if verdict is not None and args.sprt_stop:
+                pool.terminate()
+                break
+    return result, verdict, time.time() - t_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play a match between two agents')
+    parser.add_argument('--engine1', type=parse_engine, required=True,
+                        help='Agent type and options, eg. minimax:depth=3')
+    parser.add_argument('--engine2', type=parse_engine, required=True,
+                        help='Agent type and options, eg. uct:t_max=1,min_tries_per_node=5')
+    parser.add_argument('--games', type=int, default=20, help='Number of games')
+    parser.add_argument('--workers', type=int, help='Games played at once, by default one per CPU')
+    parser.add_argument('--openings', help='File with one FEN or EPD per line')
+    parser.add_argument('--output', default='tournament.pgn', help='Where to write the games')
+    parser.add_argument('--book', help='Polyglot opening book for both engines')
+    parser.add_argument('--book-plies', type=int, help='Plies to play from the book')
+    parser.add_argument('--tablebase', help='Directory with Syzygy tables for both engines')
+    parser.add_argument('--tc', type=parse_time_control,
+                        help='Game clock for both engines in seconds, base+increment or moves/base')
+    parser.add_argument('--max-plies', type=int, default=300, help='Plies before a game is drawn')
+    parser.add_argument('--elo0', type=float, default=0, help='SPRT: Elo difference of H0')
+    parser.add_argument('--elo1', type=float, default=10, help='SPRT: Elo difference of H1')
+    parser.add_argument('--alpha', type=float, default=0.05, help='SPRT: false positive rate')
+    parser.add_argument('--beta', type=float, default=0.05, help='SPRT: false negative rate')
+    parser.add_argument('--sprt-stop', action='store_true', help='Stop when the SPRT has a verdict')
+    args = parser.parse_args()
+
+    result, verdict, elapsed = run_match(args)
+    elo, (elo_low, elo_high) = result.elo()
+    print()
+    print('{} vs {}'.format(format_engine(args.engine1), format_engine(args.engine2)))
+    print('Games: {} in {:.1f}s. Score: +{} ={} -{} ({:.1%})'.format(
+        result.games(), elapsed, result.wins, result.draws, result.losses, result.score()))
+    print('Elo difference: {:+.1f} [{:+.1f}, {:+.1f}]'.format(elo, elo_low, elo_high))
+    if verdict == 'H1':
+        print('SPRT: H1 accepted, engine 1 is at least {} Elo stronger'.format(args.elo1))
+    elif verdict == 'H0':
+        print('SPRT: H0 accepted, engine 1 is at most {} Elo stronger'.format(args.elo0))
+    else:
+        print('SPRT: no verdict yet, LLR {:.2f} with bounds [{:.2f}, {:.2f}]'.format(
+            result.llr(args.elo0, args.elo1), math.log(args.beta / (1 - args.alpha)),
+            math.log((1 - args.beta) / args.alpha)))
+    print('Games written to {}'.format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Fixed-size transposition table for the alpha-beta search, see
+# https://www.chessprogramming.org/Transposition_Table
+from collections import namedtuple
+
+# Bound types. Scores are stored from white's point of view, so LOWER means the real
+#   value is at least the stored score and UPPER means it's at most the stored score
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Rough size of one stored entry (tuple + key, score and move objects) in bytes
+ENTRY_SIZE = 160
+
+TTEntry = namedtuple('TTEntry', 'key depth score bound move age')
+
+
+class TranspositionTable:
+    """ Entries are indexed by key modulo the table size. A slot is replaced when it's empty,
+    holds the same position, was written during an older search or was searched less deep
+    """
+
+    def __init__(self, size_mb=16):
+        self.size = max(1, int(size_mb * 1024 * 1024) // ENTRY_SIZE)
+        self.entries = [None] * self.size
+        self.age = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        # Entries from earlier searches are kept, but will be the first ones to be replaced
+        self.age += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.age = 0
+        self.reset_counters()
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.entries[key % self.size]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, move):
+        idx = key % self.size
+        old = self.entries[idx]
+        if old is not None:
+            if old.key == key:
+                # Keep a deeper result for the same position unless it's stale
+                if old.depth > depth and old.age == self.age:
+                    return
+            elif old.age == self.age and old.depth > depth:
+                return
+            else:
+                self.overwrites += 1
+        self.stores += 1
+        self.entries[idx] = TTEntry(key, depth, score, bound, move, self.age)
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes > 0 else 0.
+
+    def usage(self):
+        # Share of the slots that are in use
+        return sum(1 for x in self.entries if x is not None) / self.size
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'probes': self.probes,
+            'hits': self.hits,
+            'hit_rate': self.hit_rate(),
+            'stores': self.stores,
+            'overwrites': self.overwrites}
+
+
+if __name__ == "__main__":
+    print("Can't run this file directly")